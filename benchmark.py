@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import product
+
+import numpy as np
+
+from utils import make_keys
+
+SCALAR_SAMPLE = 10000  # Keys used for the per-item put/get timings
+
+
+def structure_bytes(sketch) -> int:
+    '''
+    Bytes held by the NumPy arrays of a sketch
+    '''
+    return sum(value.nbytes for value in vars(sketch).values() if isinstance(value, np.ndarray))
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def ns_per_op(func, arg, n_ops: int) -> float:
+    start = time.perf_counter_ns()
+    func(arg)
+    return (time.perf_counter_ns() - start) / max(n_ops, 1)
+
+
+def ns_per_op_scalar(func, keys) -> float:
+    start = time.perf_counter_ns()
+    for key in keys:
+        func(key)
+    return (time.perf_counter_ns() - start) / max(len(keys), 1)
+
+
+def bench_filter(cls, params: dict, n_items: int, seed: int = 0) -> dict:
+    '''
+    Bloom-like filters: batched and per-item put/get, false positive rate
+    measured on keys that were never inserted
+    '''
+    keys = make_keys(n_items, seed)
+    queries = make_keys(n_items, seed + 1)
+
+    sketch = cls(**params)
+    put_ns = ns_per_op(sketch.put_many, keys, n_items)
+    get_ns = ns_per_op(sketch.get_many, queries, n_items)
+    fpr = float(np.mean(sketch.get_many(queries)))
+
+    scalar = cls(**params)
+    sample = keys[:SCALAR_SAMPLE]
+    return {
+        'put_ns_per_op' : put_ns,
+        'get_ns_per_op' : get_ns,
+        'put_ns_per_op_scalar' : ns_per_op_scalar(scalar.put, sample),
+        'get_ns_per_op_scalar' : ns_per_op_scalar(scalar.get, sample),
+        'structure_bytes' : structure_bytes(sketch),
+        'false_positive_rate' : fpr,
+        'false_negatives' : int(n_items - np.sum(sketch.get_many(keys)))
+    }
+
+
+def bench_hll(params: dict, n_items: int, seed: int = 0) -> dict:
+    from task4 import HyperLogLog
+
+    keys = make_keys(n_items, seed)
+    hll = HyperLogLog(**params)
+    put_ns = ns_per_op(hll.put_many, keys, n_items)
+    start = time.perf_counter_ns()
+    estimate = hll.est_size()
+    estimate_ns = time.perf_counter_ns() - start
+
+    scalar = HyperLogLog(**params)
+    return {
+        'put_ns_per_op' : put_ns,
+        'put_ns_per_op_scalar' : ns_per_op_scalar(scalar.put, keys[:SCALAR_SAMPLE]),
+        'est_size_ns' : estimate_ns,
+        'structure_bytes' : structure_bytes(hll),
+        'estimate' : estimate,
+        'relative_error' : abs(estimate - n_items) / n_items
+    }
+
+
+def bench_join(n_shared: int, n_unique: int, repeats: int, tmp_prefix: str) -> dict:
+    from task6 import estimate_join_size, join_exceeds
+
+    shared = make_keys(n_shared, 0) * repeats
+    file1, file2 = f'{tmp_prefix}_join1.csv', f'{tmp_prefix}_join2.csv'
+    with open(file1, 'wb') as f1, open(file2, 'wb') as f2:
+        f1.write(b'\n'.join(shared + make_keys(n_unique, 1)) + b'\n')
+        f2.write(b'\n'.join(shared + make_keys(n_unique, 2)) + b'\n')
+    n_rows = 2 * (len(shared) + n_unique)
+    true_size = n_shared * repeats * repeats
+
+    try:
+        start = time.perf_counter_ns()
+        estimate = estimate_join_size(file1, file2)
+        estimate_ns = time.perf_counter_ns() - start
+        start = time.perf_counter_ns()
+        threshold = join_exceeds(file1, file2)
+        threshold_ns = time.perf_counter_ns() - start
+    finally:
+        os.remove(file1)
+        os.remove(file2)
+
+    result = {
+        'true_size' : true_size,
+        'estimate' : estimate if isinstance(estimate, int) else None,
+        'exceeds_reported' : not isinstance(estimate, int),
+        'estimate_ns_per_row' : estimate_ns / n_rows,
+        'join_exceeds_ns_per_row' : threshold_ns / n_rows,
+        'join_exceeds_fraction_read' : threshold['fraction_read'],
+        'join_exceeds_correct' : threshold['exceeds'] == (true_size > 10**7)
+    }
+    if result['estimate'] is not None:
+        result['relative_error'] = abs(estimate - true_size) / max(true_size, 1)
+    return result
+
+
+def bench_heavy_hitters(pattern: list, threshold: int, tmp_prefix: str) -> dict:
+    from task5 import gen_grouped_seq_fixed_keys, find_problematic_keys
+
+    file1, file2 = f'{tmp_prefix}_hh1.csv', f'{tmp_prefix}_hh2.csv'
+    gen_grouped_seq_fixed_keys(file1, pattern, to_shuffle=True)
+    gen_grouped_seq_fixed_keys(file2, pattern, to_shuffle=True)
+    n_rows = 2 * sum(n_keys * n_records for n_keys, n_records in pattern)
+
+    # Same key numbering as gen_grouped_seq_fixed_keys
+    expected, num = set(), 0
+    for n_keys, n_records in pattern:
+        if n_records > threshold:
+            expected |= {f'key{i + num}' for i in range(n_keys)}
+        num += n_keys
+
+    try:
+        start = time.perf_counter_ns()
+        found = find_problematic_keys(file1, file2, threshold)
+        elapsed = time.perf_counter_ns() - start
+    finally:
+        os.remove(file1)
+        os.remove(file2)
+
+    return {
+        'ns_per_row' : elapsed / n_rows,
+        'precision' : len(found & expected) / len(found) if found else 1.0,
+        'recall' : len(found & expected) / len(expected) if expected else 1.0
+    }
+
+
+def run_case(case: dict) -> dict:
+    '''
+    Runs one benchmark case. Called in a fresh process so peak RSS is per case.
+    '''
+    from task1 import BloomFilterNumpy
+    from task2 import KBloomFilterNumpy, BlockedBloomFilterNumpy
+    from task3 import CountingBloomFilter
+
+    sketch, params = case['sketch'], case['params']
+    tmp_prefix = f'bench_{os.getpid()}'
+    if sketch == 'BloomFilterNumpy':
+        metrics = bench_filter(BloomFilterNumpy, params['filter'], params['n_items'])
+    elif sketch == 'KBloomFilterNumpy':
+        metrics = bench_filter(KBloomFilterNumpy, params['filter'], params['n_items'])
+    elif sketch == 'BlockedBloomFilterNumpy':
+        metrics = bench_filter(BlockedBloomFilterNumpy, params['filter'], params['n_items'])
+    elif sketch == 'CountingBloomFilter':
+        metrics = bench_filter(CountingBloomFilter, params['filter'], params['n_items'])
+    elif sketch == 'HyperLogLog':
+        metrics = bench_hll(params['hll'], params['n_items'])
+    elif sketch == 'estimate_join_size':
+        metrics = bench_join(params['n_shared'], params['n_unique'], params['repeats'], tmp_prefix)
+    elif sketch == 'find_problematic_keys':
+        metrics = bench_heavy_hitters(params['pattern'], params['threshold'], tmp_prefix)
+    else:
+        raise ValueError(f'Unknown sketch {sketch}')
+    metrics['peak_rss_bytes'] = peak_rss_bytes()
+    return {**case, **metrics}
+
+
+def build_grid(quick: bool) -> list:
+    '''
+    Parameter grid, `quick` keeps every sketch but only small sizes
+    '''
+    item_counts = [5000, 50000] if quick else [5000, 500000, 5000000]
+    bf_sizes = [65536, 16777216]
+    cases = []
+    for n, n_items in product(bf_sizes, item_counts):
+        cases.append({'sketch' : 'BloomFilterNumpy',
+                      'params' : {'filter' : {'n' : n}, 'n_items' : n_items}})
+    for sketch, n, k, n_items in product(['KBloomFilterNumpy', 'BlockedBloomFilterNumpy'],
+                                         bf_sizes, [1, 2, 3, 4], item_counts):
+        cases.append({'sketch' : sketch,
+                      'params' : {'filter' : {'n' : n, 'k' : k}, 'n_items' : n_items}})
+    for cap, k, n_items in product([2, 4], [3], item_counts):
+        cases.append({'sketch' : 'CountingBloomFilter',
+                      'params' : {'filter' : {'k' : k, 'n' : 1 << 20, 'cap' : cap},
+                                  'n_items' : n_items}})
+    for (b, hash_bits, sparse), n_items in product([(14, 32, False), (14, 64, False),
+                                                    (14, 64, True), (18, 64, False)],
+                                                   [1000] + item_counts):
+        cases.append({'sketch' : 'HyperLogLog',
+                      'params' : {'hll' : {'b' : b, 'hash_bits' : hash_bits, 'sparse' : sparse},
+                                  'n_items' : n_items}})
+    join_sizes = [(40000, 40000, 1), (10000, 20000, 40)] if quick else \
+        [(40000, 40000, 1), (1100000, 100000, 1), (10000, 20000, 40)]
+    for n_shared, n_unique, repeats in join_sizes:
+        cases.append({'sketch' : 'estimate_join_size',
+                      'params' : {'n_shared' : n_shared, 'n_unique' : n_unique,
+                                  'repeats' : repeats}})
+    patterns = [[(10, 7000), (50, 3000)]] if quick else [[(10, 70000), (50, 30000)]]
+    for pattern in patterns:
+        cases.append({'sketch' : 'find_problematic_keys',
+                      'params' : {'pattern' : pattern,
+                                  'threshold' : pattern[0][1] * 6 // 7}})
+    return cases
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(quick: bool = False,
+                   only: list = None) -> dict:
+    cases = [case for case in build_grid(quick) if not only or case['sketch'] in only]
+    results = []
+    for case in cases:
+        # One process per case: peak RSS of a case isn't polluted by the previous ones
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_case, case).result()
+        print(json.dumps(result))
+        results.append(result)
+    return {
+        'meta' : {
+            'git_revision' : git_revision(),
+            'timestamp' : datetime.now(timezone.utc).isoformat(),
+            'python' : platform.python_version(),
+            'numpy' : np.__version__,
+            'platform' : platform.platform(),
+            'quick' : quick
+        },
+        'results' : results
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark all sketches over a parameter grid')
+    parser.add_argument('--quick', action='store_true', help='small sizes only')
+    parser.add_argument('--only', nargs='*', help='sketch names to run, e.g. HyperLogLog')
+    parser.add_argument('--output', help='JSON file, defaults to results/bench_<revision>.json')
+    args = parser.parse_args()
+
+    report = run_benchmarks(quick=args.quick, only=args.only)
+
+    output = args.output or f"results/bench_{report['meta']['git_revision'][:12]}.json"
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
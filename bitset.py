@@ -0,0 +1,56 @@
+import numpy as np
+
+WORD_BITS = 64
+
+
+def bit_words(n: int) -> np.ndarray:
+    """
+    Allocates a zeroed packed bit array of n bits on uint64 words.
+    """
+    return np.zeros((n + WORD_BITS - 1) // WORD_BITS, dtype=np.uint64)
+
+
+def aligned_bit_words(n: int,
+                      align: int = 64) -> np.ndarray:
+    """
+    Same as bit_words, but the first word starts on an `align`-byte boundary,
+    so consecutive 512-bit blocks map to whole 64-byte cache lines.
+    """
+    n_words = (n + WORD_BITS - 1) // WORD_BITS
+    raw = np.zeros(n_words * 8 + align, dtype=np.uint8)
+    offset = -raw.ctypes.data % align
+    return raw[offset:offset + n_words * 8].view(np.uint64)
+
+
+def set_bit(words: np.ndarray, index: int) -> None:
+    """Set a single bit."""
+    words[index >> 6] |= np.uint64(1 << (index & 63))
+
+
+def test_bit(words: np.ndarray, index: int) -> bool:
+    """Check a single bit."""
+    return bool((int(words[index >> 6]) >> (index & 63)) & 1)
+
+
+def set_bits(words: np.ndarray, indices: np.ndarray) -> None:
+    """
+    Set all bits from an index array of any shape.
+    Repeated indices and indices sharing a word are handled by bitwise_or.at.
+    """
+    indices = np.asarray(indices, dtype=np.uint64).ravel()
+    masks = np.left_shift(np.uint64(1), indices & np.uint64(63))
+    np.bitwise_or.at(words, indices >> np.uint64(6), masks)
+
+
+def test_bits(words: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Check all bits from an index array, returns a boolean array of the same shape.
+    """
+    indices = np.asarray(indices, dtype=np.uint64)
+    shifted = words[indices >> np.uint64(6)] >> (indices & np.uint64(63))
+    return (shifted & np.uint64(1)).astype(bool)
+
+
+def count_bits(words: np.ndarray) -> int:
+    """Number of set bits (popcount over all words)."""
+    return int(np.bitwise_count(words).sum())
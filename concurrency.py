@@ -0,0 +1,275 @@
+'''
+Thread-safe variants of the Bloom filters for one shared in-memory filter
+used by many threads.
+
+Semantics:
+- Inserts are never lost. Every read-modify-write of a uint64 word is done
+  while holding the lock of the stripe (contiguous range of words) that
+  contains it. A thread holds at most one stripe lock at a time, except for
+  whole-filter operations, which take all of them in order.
+- Queries take no locks. Every word is written with a single 64-bit store
+  and read with a single load, so a query sees each word either before or
+  after an update, never halfway.
+- Once put/put_many has returned, get/get_many from any thread find the keys.
+  A query running concurrently with an insert may or may not see the keys
+  being inserted.
+- Batches do the heavy NumPy work (sorting, OR-reducing bit masks per word)
+  before taking any lock, and NumPy releases the GIL for it. Under a lock
+  there is only one gather and one scatter per stripe.
+  Hashing (mmh3 per key) still holds the GIL.
+'''
+import copy
+import sys
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+
+import numpy as np
+
+from hashing import indices_from_pairs
+from task2 import KBloomFilterNumpy
+from task3 import CountingBloomFilter
+
+DEFAULT_STRIPES = 64
+
+
+class StripedLocks:
+    def __init__(self,
+                 n_words: int,
+                 n_stripes: int = DEFAULT_STRIPES):
+        """
+        One lock per contiguous range of words of a packed array.
+        """
+        self.n_words = n_words
+        self.n_stripes = max(1, min(n_stripes, n_words))
+        self.words_per_stripe = -(-n_words // self.n_stripes)
+        self._locks = [threading.Lock() for _ in range(self.n_stripes)]
+
+    def for_word(self, word: int) -> threading.Lock:
+        return self._locks[word // self.words_per_stripe]
+
+    @contextmanager
+    def for_words(self, words):
+        """Holds the locks of all stripes containing `words`, taken in ascending order."""
+        stripes = sorted({word // self.words_per_stripe for word in words})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._locks[stripe])
+            yield
+
+    @contextmanager
+    def all(self):
+        """Holds every lock, for operations on the whole array."""
+        with self.for_words(range(0, self.n_words, self.words_per_stripe)):
+            yield
+
+    def segments(self, sorted_words: np.ndarray):
+        """
+        Splits a sorted array of word indices by stripe.
+        Yields (lock, lo, hi) for every stripe hit, sorted_words[lo:hi] belong to it.
+        """
+        if not len(sorted_words):
+            return
+        stripes = sorted_words // np.uint64(self.words_per_stripe)
+        bounds = (np.flatnonzero(np.diff(stripes)) + 1).tolist()
+        for lo, hi in zip([0] + bounds, bounds + [len(sorted_words)]):
+            yield self._locks[int(stripes[lo])], lo, hi
+
+    # Locks can't be copied or pickled, copies get fresh ones
+    def __deepcopy__(self, memo):
+        return StripedLocks(self.n_words, self.n_stripes)
+
+    def __getstate__(self):
+        return {'n_words' : self.n_words, 'n_stripes' : self.n_stripes}
+
+    def __setstate__(self, state):
+        self.__init__(state['n_words'], state['n_stripes'])
+
+
+def _or_masks_by_word(indices: np.ndarray):
+    '''
+    Sorted unique words touched by bit `indices` and the OR of their bits in each word
+    '''
+    indices = np.sort(indices.ravel())
+    words = indices >> np.uint64(6)
+    bits = np.left_shift(np.uint64(1), indices & np.uint64(63))
+    unique_words, starts = np.unique(words, return_index=True)
+    return unique_words, np.bitwise_or.reduceat(bits, starts)
+
+
+class ConcurrentKBloomFilterNumpy(KBloomFilterNumpy):
+    def __init__(self,
+                 n: int,
+                 k: int,
+                 n_stripes: int = DEFAULT_STRIPES):
+        """
+        KBloomFilterNumpy safe for concurrent put/get from many threads,
+        see the module docstring for the guarantees.
+        """
+        super().__init__(n=n, k=k)
+        self.locks = StripedLocks(len(self.bit_array), n_stripes)
+
+    def put(self, item):
+        for index in self._hashes(item):
+            word = index >> 6
+            with self.locks.for_word(word):
+                self.bit_array[word] |= np.uint64(1 << (index & 63))
+
+    def put_pairs(self, pairs):
+        """Insert a batch, each word is updated once under its stripe lock."""
+        words, masks = _or_masks_by_word(self._pair_indices(pairs))
+        for lock, lo, hi in self.locks.segments(words):
+            with lock:
+                self.bit_array[words[lo:hi]] |= masks[lo:hi]
+
+    def merge(self, other):
+        with self.locks.all():
+            return super().merge(other)
+
+
+class ConcurrentCountingBloomFilter(CountingBloomFilter):
+    def __init__(self,
+                 k: int,
+                 n: int,
+                 cap: int,
+                 n_stripes: int = DEFAULT_STRIPES):
+        """
+        CountingBloomFilter safe for concurrent put/get/remove from many threads,
+        see the module docstring for the guarantees.
+        remove_many and merge lock the whole filter.
+        """
+        super().__init__(k=k, n=n, cap=cap)
+        self.locks = StripedLocks(self.num_ints, n_stripes)
+
+    def _write_counters(self, counter_indices, values):
+        """
+        Counter indices must be sorted and unique. Counters of one word are then
+        adjacent, so each word is rebuilt once and written with a single store,
+        readers never see a counter cleared halfway through an update.
+        """
+        if not len(counter_indices):
+            return
+        int_indices, bit_offsets = self._locate(counter_indices)
+        words, starts = np.unique(int_indices, return_index=True)
+        clear = np.bitwise_or.reduceat(np.uint64(self.mask) << bit_offsets, starts)
+        fill = np.bitwise_or.reduceat(values << bit_offsets, starts)
+        self.bit_array[words] = (self.bit_array[words] & ~clear) | fill
+
+    def put(self, item):
+        for hash_value in self._hashes(item):
+            int_index, bit_offset = self._get_counter_index_and_offset(hash_value)
+            with self.locks.for_word(int_index):
+                current_count = (int(self.bit_array[int_index]) >> bit_offset) & self.mask
+                if current_count < self.mask:
+                    self.bit_array[int_index] += np.uint64(1 << bit_offset)
+
+    def put_pairs(self, pairs):
+        """Insert a batch, counters of each stripe are updated under its lock."""
+        counter_indices, counts = np.unique(indices_from_pairs(pairs, self.k, self.n),
+                                            return_counts=True)
+        counts = counts.astype(np.uint64)
+        words = counter_indices // np.uint64(self.counters_per_int)
+        mask = np.uint64(self.mask)
+        for lock, lo, hi in self.locks.segments(words):
+            with lock:
+                current = self._read_counters(counter_indices[lo:hi])
+                self._write_counters(counter_indices[lo:hi],
+                                     np.minimum(current + counts[lo:hi], mask))
+
+    def remove(self, item):
+        """Same as CountingBloomFilter.remove, holds the locks of all the item's counters."""
+        int_indices = [hash_value // self.counters_per_int for hash_value in self._hashes(item)]
+        with self.locks.for_words(int_indices):
+            return super().remove(item)
+
+    def remove_many(self, keys) -> np.ndarray:
+        with self.locks.all():
+            return super().remove_many(keys)
+
+    def merge(self, other):
+        """Merges in place, keeping the array shared with other threads."""
+        with self.locks.all():
+            words = self.bit_array
+            super().merge(other)
+            words[:] = self.bit_array
+            self.bit_array = words
+        return self
+
+
+def stress_test(sketch,
+                n_writers: int = 4,
+                n_readers: int = 4,
+                n_batches: int = 40,
+                batch_size: int = 2000) -> dict:
+    '''
+    Writer threads insert disjoint keys into one shared sketch, alternating
+    put_many and per-item put, while reader threads query batches that writers
+    already finished. Returns lost inserts (keys missing at the end or in a
+    reader's check) and whether the words equal a single-threaded build.
+    '''
+    batches = [[f'w{w}-b{b}-{i}'.encode() for i in range(batch_size)]
+               for w in range(n_writers) for b in range(n_batches)]
+    done = []
+    stop = threading.Event()
+    reader_misses = []
+
+    def writer(w):
+        for b in range(n_batches):
+            batch = batches[w * n_batches + b]
+            if b % 2:
+                sketch.put_many(batch)
+            else:
+                for key in batch:
+                    sketch.put(key)
+            done.append(batch)
+
+    def reader():
+        rng = np.random.default_rng(threading.get_ident() % 2**32)
+        misses = 0
+        while not stop.is_set():
+            if done:
+                misses += int((~sketch.get_many(done[rng.integers(len(done))])).sum())
+        reader_misses.append(misses)
+
+    readers = [threading.Thread(target=reader) for _ in range(n_readers)]
+    writers = [threading.Thread(target=writer, args=(w,)) for w in range(n_writers)]
+    start = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    reference = copy.deepcopy(sketch)
+    reference.bit_array = np.zeros_like(sketch.bit_array)
+    for batch in batches:
+        reference.put_many(batch)
+
+    all_keys = [key for batch in batches for key in batch]
+    return {
+        'sketch' : type(sketch).__name__,
+        'keys' : len(all_keys),
+        'lost_inserts' : int((~sketch.get_many(all_keys)).sum()),
+        'reader_misses' : sum(reader_misses),
+        'matches_sequential' : bool(np.array_equal(sketch.bit_array, reference.bit_array)),
+        'seconds' : elapsed
+    }
+
+
+if __name__ == '__main__':
+
+    # Switch threads as often as possible to provoke races
+    sys.setswitchinterval(1e-6)
+
+    sketches = [
+        ConcurrentKBloomFilterNumpy(n=1 << 20, k=3),
+        ConcurrentCountingBloomFilter(k=3, n=1 << 20, cap=8),
+        # Unsynchronized classes for comparison, these can lose updates
+        KBloomFilterNumpy(n=1 << 20, k=3),
+        CountingBloomFilter(k=3, n=1 << 20, cap=8)
+    ]
+    for sketch in sketches:
+        print(stress_test(sketch))
@@ -0,0 +1,92 @@
+import numpy as np
+
+from hashing import hash_pairs, indices_from_pairs
+
+
+class CountMinSketch:
+    def __init__(self,
+                 width: int,
+                 depth: int,
+                 conservative: bool = False):
+        """
+        Count-Min Sketch on a dense depth x width counter matrix.
+
+        Parameters:
+        width (int): Counters per row.
+        depth (int): Number of rows, row i hashes with (h1 + i * h2) mod width.
+        conservative (bool): Conservative update, a key only raises its counters
+            up to its new minimum estimate. Never underestimates, overestimates less.
+        """
+        self.width = width
+        self.depth = depth
+        self.conservative = conservative
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._rows = np.arange(depth)
+
+    def _flat_indices(self, pairs):
+        """Positions of the keys' counters in the flattened table, shape (n_keys, depth)."""
+        columns = indices_from_pairs(pairs, self.depth, self.width).astype(np.int64)
+        return columns + self._rows * self.width
+
+    def add(self, key, count: int = 1):
+        """Add count occurrences of a key."""
+        self.add_many([key], np.array([count]))
+
+    def add_many(self, keys, counts=None):
+        """
+        Add a batch of keys, counts defaults to one occurrence per key.
+        """
+        self.add_pairs(hash_pairs(keys), counts)
+
+    def add_pairs(self, pairs, counts=None):
+        """add_many for keys already hashed with hashing.hash_pairs."""
+        flat = self._flat_indices(pairs)
+        counts = np.ones(len(flat), dtype=np.int64) if counts is None \
+            else np.asarray(counts, dtype=np.int64)
+        table = self.table.reshape(-1)
+        if not self.conservative:
+            np.add.at(table, flat, counts[:, np.newaxis])
+        else:
+            # Aggregate repeated keys first, then raise every counter of a key
+            # to (current estimate + count). Counters shared by several keys keep the max.
+            flat, inverse = np.unique(flat, axis=0, return_inverse=True)
+            counts = np.bincount(inverse.ravel(), weights=counts).astype(np.int64)
+            updated = table[flat].min(axis=1) + counts
+            np.maximum.at(table, flat, updated[:, np.newaxis])
+        self.total += int(counts.sum())
+
+    def update_many(self, keys):
+        self.add_many(keys)
+
+    def update_pairs(self, pairs):
+        self.add_pairs(pairs)
+
+    def estimate(self, key) -> int:
+        """Upper bound on the number of occurrences of a key (with high probability tight)."""
+        return int(self.estimate_many([key])[0])
+
+    def estimate_many(self, keys) -> np.ndarray:
+        """Estimates for a batch of keys."""
+        return self.table.reshape(-1)[self._flat_indices(hash_pairs(keys))].min(axis=1)
+
+    def inner_product(self, other, debias: bool = False) -> float:
+        """
+        Estimate sum over keys of count_self(key) * count_other(key), i.e. the size
+        of an equi-join between the two streams, from the sketches alone.
+
+        The default is the minimum of the row dot products, which never underestimates.
+        debias=True subtracts the expected contribution of hash collisions
+        (total_self * total_other / width) from every row and takes the median,
+        which is unbiased but no longer an upper bound.
+        """
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Sketches must have the same width and depth')
+        row_products = np.array([np.dot(self.table[row].astype(np.float64),
+                                        other.table[row].astype(np.float64))
+                                 for row in range(self.depth)])
+        if not debias:
+            return float(row_products.min())
+        collisions = self.total * other.total / self.width
+        corrected = (row_products - collisions) / (1 - 1 / self.width)
+        return max(float(np.median(corrected)), 0.0)
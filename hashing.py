@@ -0,0 +1,101 @@
+'''
+Hashing shared by all sketches.
+
+Every key is hashed once with 128-bit MurmurHash3 (x64 variant, seed 0).
+The two little-endian 64-bit halves h1, h2 give any number of indices by
+Kirsch-Mitzenmacher double hashing:
+
+    index_i = (h1 + i * h2) mod 2^64 mod n
+
+When n is a power of two the last modulo is computed as a mask, n - 1,
+which gives the same indices.
+
+HASH_VERSION identifies this scheme in serialized sketches, it must change
+whenever any of the above does, so that sketches built by different
+processes or versions are only combined when their indices agree.
+'''
+from typing import List
+
+import mmh3
+import numpy as np
+
+HASH_VERSION = 1  # mmh3 x64 128-bit hash, seed 0
+SEED_SCHEME = 1  # index i = (h1 + i * h2) mod 2^64 mod n
+UINT64_MASK = (1 << 64) - 1
+
+
+def is_power_of_two(n: int) -> bool:
+    return n > 0 and n & (n - 1) == 0
+
+
+def hash_pairs(keys) -> np.ndarray:
+    '''
+    Hashes a batch of keys (str or bytes), one mmh3 call per key.
+    Returns an (n_keys, 2) uint64 array of (h1, h2).
+    '''
+    buffer = b''.join(map(mmh3.hash_bytes, keys))
+    return np.frombuffer(buffer, dtype='<u8').reshape(-1, 2).astype(np.uint64)
+
+
+def hash_pairs_offsets(buffer: bytes,
+                       starts: np.ndarray,
+                       ends: np.ndarray) -> np.ndarray:
+    '''
+    hash_pairs for keys given as offsets into one buffer,
+    as produced by key_reader.key_offsets
+    '''
+    keys = map(buffer.__getitem__, map(slice, starts.tolist(), ends.tolist()))
+    return hash_pairs(keys)
+
+
+def indices_from_pairs(pairs: np.ndarray,
+                       k: int,
+                       n: int) -> np.ndarray:
+    '''
+    k double-hashing indices in [0, n) for every (h1, h2) pair.
+    Returns an (n_keys, k) uint64 array.
+    '''
+    steps = np.arange(k, dtype=np.uint64)
+    combined = pairs[:, :1] + steps * pairs[:, 1:]
+    if is_power_of_two(n):
+        return combined & np.uint64(n - 1)
+    return combined % np.uint64(n)
+
+
+def hash_indices(keys,
+                 k: int,
+                 n: int) -> np.ndarray:
+    '''
+    k indices in [0, n) for every key of a batch, shape (n_keys, k)
+    '''
+    return indices_from_pairs(hash_pairs(keys), k, n)
+
+
+def item_pair(item) -> tuple:
+    '''
+    (h1, h2) of a single key as Python ints
+    '''
+    h = mmh3.hash128(item)
+    return h & UINT64_MASK, h >> 64
+
+
+def item_indices(item,
+                 k: int,
+                 n: int) -> List[int]:
+    '''
+    Scalar version of hash_indices for a single key
+    '''
+    return pair_indices(*item_pair(item), k, n)
+
+
+def pair_indices(h1: int,
+                 h2: int,
+                 k: int,
+                 n: int) -> List[int]:
+    '''
+    k indices in [0, n) from an already computed (h1, h2)
+    '''
+    if is_power_of_two(n):
+        mask = n - 1
+        return [(h1 + i * h2) & mask for i in range(k)]
+    return [((h1 + i * h2) & UINT64_MASK) % n for i in range(k)]
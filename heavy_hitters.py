@@ -0,0 +1,43 @@
+import heapq
+from collections import Counter
+
+
+class MisraGries:
+    def __init__(self, capacity: int):
+        """
+        Misra-Gries frequent items summary with at most `capacity` counters.
+
+        Every stored count is a lower bound of the true count and undercounts
+        by at most `error` <= total / (capacity + 1). Any key occurring more
+        than `error` times is guaranteed to be stored.
+        """
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+        self.error = 0
+
+    def update_many(self, keys):
+        """
+        Add a batch of keys. The batch is merged as an exact summary and the
+        (capacity + 1)-th largest count is subtracted from all counters,
+        as in the mergeable summaries construction.
+        """
+        counters = self.counters
+        for key, count in Counter(keys).items():
+            counters[key] = counters.get(key, 0) + count
+        self.total += len(keys)
+        if len(counters) > self.capacity:
+            cut = heapq.nlargest(self.capacity + 1, counters.values())[-1]
+            self.error += cut
+            self.counters = {key: count - cut for key, count in counters.items() if count > cut}
+
+    def lower_bound(self, key) -> int:
+        return self.counters.get(key, 0)
+
+    def upper_bound(self, key) -> int:
+        return self.counters.get(key, 0) + self.error
+
+    @property
+    def is_exact(self) -> bool:
+        """True while nothing was ever evicted, counts are exact."""
+        return self.error == 0
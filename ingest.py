@@ -0,0 +1,272 @@
+'''
+Asyncio ingestion pipeline: many key streams (files, sockets) feed any set of
+sketches, with reading, hashing and sketch updates overlapped.
+
+    sources --> chunk queue --> hashing workers --> result queue --> sketches
+                 (bounded)      (process pool)       (bounded)
+
+- Every source is read by its own task in chunks of whole lines. Files are
+  read in a thread, sockets with asyncio streams.
+- Both queues are bounded. When hashing falls behind, readers wait on the
+  full chunk queue and stop reading, so memory doesn't depend on the input size.
+- Workers split chunks into keys and hash them with hashing.hash_pairs in a
+  process pool. The event loop only moves chunks and (h1, h2) arrays.
+- A single task applies the results. Sketches are never updated concurrently,
+  so any sketch works without locks.
+
+A sketch only needs `update_many(keys)`. Sketches that also have
+`update_pairs(pairs)` get the pre-hashed batch and skip hashing on the event
+loop. Keys are sent back from the workers only if some sketch has no
+update_pairs.
+'''
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import AsyncIterator, Iterable, List, Protocol
+
+from hashing import hash_pairs
+from key_reader import CHUNK_BYTES, iter_chunks, split_keys
+
+QUEUE_SIZE = 8  # Chunks waiting in each queue
+
+
+class Sketch(Protocol):
+    def update_many(self, keys) -> None:
+        ...
+
+
+async def file_source(path: str,
+                      chunk_bytes: int = CHUNK_BYTES) -> AsyncIterator[bytes]:
+    '''
+    Chunks of whole lines of a file, every blocking read runs in a thread
+    '''
+    chunks = iter_chunks(path, chunk_bytes)
+    while True:
+        item = await asyncio.to_thread(next, chunks, None)
+        if item is None:
+            return
+        yield item[0]
+
+
+async def stream_source(reader: asyncio.StreamReader,
+                        chunk_bytes: int = CHUNK_BYTES) -> AsyncIterator[bytes]:
+    '''
+    Chunks of whole lines from an asyncio stream until EOF,
+    a partial last line is completed with a newline
+    '''
+    carry = b''
+    while True:
+        block = await reader.read(chunk_bytes)
+        if not block:
+            break
+        block = carry + block
+        cut = block.rfind(b'\n') + 1
+        carry = block[cut:]
+        if cut:
+            yield block[:cut]
+    if carry:
+        yield carry + b'\n'
+
+
+async def socket_source(host: str,
+                        port: int,
+                        chunk_bytes: int = CHUNK_BYTES) -> AsyncIterator[bytes]:
+    '''
+    Connects to host:port and reads newline-separated keys until the peer closes
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        async for chunk in stream_source(reader, chunk_bytes):
+            yield chunk
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+def hash_chunk(chunk: bytes,
+               delimiter: bytes,
+               with_keys: bool) -> tuple:
+    '''
+    Worker side: keys of a chunk and their (h1, h2) pairs.
+    Keys are only returned when asked, to keep the transfer small.
+    '''
+    keys = split_keys(chunk, delimiter)
+    return (keys if with_keys else None), hash_pairs(keys)
+
+
+async def ingest(sources: Iterable[AsyncIterator[bytes]],
+                 sketches: List[Sketch],
+                 delimiter: bytes = b',',
+                 n_workers: int = None,
+                 executor: Executor = None,
+                 queue_size: int = QUEUE_SIZE) -> dict:
+    '''
+    Streams every source into every sketch concurrently.
+
+    Parameters:
+    sources: Async iterators of chunks (file_source, stream_source, socket_source).
+    sketches: Objects with update_many(keys), and optionally update_pairs(pairs).
+    delimiter (bytes): Keys are the first field of every line.
+    n_workers (int): Hashing tasks in flight, defaults to the CPU count.
+    executor: Where hashing runs, defaults to a spawn ProcessPoolExecutor owned by the call.
+    queue_size (int): Capacity of each queue in chunks.
+
+    Returns a dict with the number of chunks, keys and bytes ingested and the elapsed time.
+    '''
+    n_workers = n_workers or os.cpu_count() or 1
+    own_executor = executor is None
+    if own_executor:
+        # Not forked: file sources read in threads, a fork could copy a held lock
+        executor = ProcessPoolExecutor(max_workers=n_workers,
+                                       mp_context=multiprocessing.get_context('spawn'))
+    loop = asyncio.get_running_loop()
+    with_keys = any(getattr(sketch, 'update_pairs', None) is None for sketch in sketches)
+    chunks = asyncio.Queue(maxsize=queue_size)
+    results = asyncio.Queue(maxsize=queue_size)
+    stats = {'chunks' : 0, 'keys' : 0, 'bytes' : 0}
+
+    async def read(source):
+        async for chunk in source:
+            stats['bytes'] += len(chunk)
+            await chunks.put(chunk)
+
+    async def hash_worker():
+        while (chunk := await chunks.get()) is not None:
+            await results.put(await loop.run_in_executor(executor, hash_chunk, chunk,
+                                                         delimiter, with_keys))
+
+    async def apply():
+        while (result := await results.get()) is not None:
+            keys, pairs = result
+            for sketch in sketches:
+                update_pairs = getattr(sketch, 'update_pairs', None)
+                if update_pairs is not None:
+                    update_pairs(pairs)
+                else:
+                    sketch.update_many(keys)
+            stats['chunks'] += 1
+            stats['keys'] += len(pairs)
+
+    async def finish():
+        # Stops the stages in order once every source is exhausted
+        await asyncio.gather(*readers)
+        for _ in workers:
+            await chunks.put(None)
+        await asyncio.gather(*workers)
+        await results.put(None)
+        await applier
+
+    start = time.perf_counter()
+    workers = [asyncio.create_task(hash_worker()) for _ in range(n_workers)]
+    applier = asyncio.create_task(apply())
+    readers = [asyncio.create_task(read(source)) for source in sources]
+    tasks = readers + workers + [applier, asyncio.create_task(finish())]
+    try:
+        # A failed task would leave the others blocked on a queue, so any
+        # failure ends the wait and is raised after cancelling the rest
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        errors = [task.exception() for task in done
+                  if not task.cancelled() and task.exception() is not None]
+        if errors:
+            raise errors[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def ingest_files(paths: Iterable[str],
+                 sketches: List[Sketch],
+                 **kwargs) -> dict:
+    '''
+    Synchronous entry point: ingest files into sketches, see `ingest`
+    '''
+    return asyncio.run(ingest([file_source(path) for path in paths], sketches, **kwargs))
+
+
+class _FailingSketch:
+    # Stands in for a broken sketch in the demo
+    def update_many(self, keys):
+        raise ValueError('update_many failed')
+
+
+async def _serve_file(path: str) -> asyncio.AbstractServer:
+    # Local server sending a file to every client, stands in for a live stream
+    async def send(reader, writer):
+        for chunk, _ in iter_chunks(path):
+            writer.write(chunk)
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    return await asyncio.start_server(send, '127.0.0.1', 0)
+
+
+async def _run_demo(paths: List[str],
+                    sketches: List[Sketch]) -> dict:
+    server = await _serve_file(paths[0])
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        sources = [socket_source('127.0.0.1', port)] + [file_source(path) for path in paths[1:]]
+        return await ingest(sources, sketches)
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    from count_min import CountMinSketch
+    from heavy_hitters import MisraGries
+    from key_reader import iter_key_batches
+    from task2 import KBloomFilterNumpy
+    from task4 import HyperLogLog
+    from utils import gen_uniq_seq
+
+    def make_sketches():
+        return [KBloomFilterNumpy.for_capacity(4_000_000, 0.01),
+                HyperLogLog(b=14, hash_bits=64),
+                CountMinSketch(width=2**20, depth=4),
+                MisraGries(capacity=1000)]
+
+    paths = [f'ingest_{i}.csv' for i in range(4)]
+    for i, path in enumerate(paths):
+        gen_uniq_seq(path, 1_000_000, seed=i)
+
+    # One stream arrives over a socket, the rest are files
+    pipelined = make_sketches()
+    stats = asyncio.run(_run_demo(paths, pipelined))
+    print(f"Pipeline: {stats['keys']:,} keys from {len(paths)} streams "
+          f"in {stats['seconds']:.2f} s, {stats['keys'] / stats['seconds']:,.0f} keys/sec")
+
+    serial = make_sketches()
+    start = time.perf_counter()
+    for path in paths:
+        for keys in iter_key_batches(path):
+            for sketch in serial:
+                sketch.update_many(keys)
+    elapsed = time.perf_counter() - start
+    print(f"Serial:   {stats['keys']:,} keys in {elapsed:.2f} s, "
+          f"{stats['keys'] / elapsed:,.0f} keys/sec")
+
+    assert np.array_equal(pipelined[0].bit_array, serial[0].bit_array)
+    assert np.array_equal(pipelined[1].registers, serial[1].registers)
+    assert np.array_equal(pipelined[2].table, serial[2].table)
+    print(f'Same sketches as the serial pass, HyperLogLog estimate {pipelined[1].est_size():,.0f}')
+
+    # A failing sketch stops the pipeline with its error instead of hanging it
+    try:
+        asyncio.run(asyncio.wait_for(ingest([file_source(path) for path in paths],
+                                            [_FailingSketch()]), timeout=60))
+    except ValueError as error:
+        print(f'Failing sketch stopped the pipeline: {error}')
+    else:
+        raise AssertionError('ingest finished despite a failing sketch')
+
+    for path in paths:
+        os.remove(path)
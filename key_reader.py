@@ -0,0 +1,120 @@
+import os
+import re
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+CHUNK_BYTES = 1 << 22
+
+_key_patterns = {}
+
+
+def iter_chunks(path: str,
+                chunk_bytes: int = CHUNK_BYTES,
+                start: int = 0,
+                end: int = None) -> Iterator[Tuple[bytes, int]]:
+    '''
+    Reads the byte range [start, end) of a file in large binary blocks.
+    Yields (chunk, bytes consumed so far), every chunk holds whole lines
+    and ends with a newline (the last line of the file gets one if missing).
+    '''
+    end = os.path.getsize(path) if end is None else end
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        carry = b''
+        consumed = 0
+        while remaining > 0:
+            block = f.read(min(chunk_bytes, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            block = carry + block
+            cut = block.rfind(b'\n') + 1
+            carry = block[cut:]
+            if cut:
+                consumed += cut
+                yield block[:cut], consumed
+        if carry:
+            yield carry + b'\n', consumed + len(carry)
+
+
+def split_keys(chunk: bytes,
+               delimiter: bytes = b',') -> List[bytes]:
+    '''
+    First field (up to `delimiter`) of every line of a chunk, empty keys are skipped.
+    The work is done by bytes.split or a compiled regex, no per-line Python code.
+    Multi-byte delimiters are matched as a whole.
+    '''
+    if not delimiter:
+        raise ValueError('Delimiter must not be empty')
+    if delimiter not in chunk and b'\r' not in chunk:
+        return list(filter(None, chunk.split(b'\n')))
+    pattern = _key_patterns.get(delimiter)
+    if pattern is None:
+        if len(delimiter) == 1:
+            key = rb'[^\r\n' + re.escape(delimiter) + rb']+'
+        else:
+            # Any byte but a line end, as long as the delimiter doesn't start there
+            key = rb'(?:(?!' + re.escape(delimiter) + rb')[^\r\n])+'
+        pattern = re.compile(rb'^(' + key + rb')', re.MULTILINE)
+        _key_patterns[delimiter] = pattern
+    return pattern.findall(chunk)
+
+
+def key_offsets(chunk: bytes,
+                delimiter: bytes = b',') -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Offsets of the first field of every line: key i is chunk[starts[i]:ends[i]].
+    Computed with NumPy over the raw buffer, empty keys are skipped.
+    The delimiter must be a single byte.
+    '''
+    if len(delimiter) != 1:
+        raise ValueError(f'Delimiter must be a single byte, got {delimiter!r}')
+    buffer = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero(buffer == ord('\n'))
+    starts = np.concatenate(([0], line_ends[:-1] + 1))
+    ends = line_ends.copy()
+
+    # Drop the carriage return of \r\n line endings
+    has_cr = (ends > starts) & (buffer[np.maximum(ends - 1, 0)] == ord('\r'))
+    ends[has_cr] -= 1
+
+    delimiters = np.flatnonzero(buffer == ord(delimiter))
+    if len(delimiters):
+        # First delimiter at or after the line start, if it's before the line end
+        first = np.searchsorted(delimiters, starts)
+        found = first < len(delimiters)
+        candidates = delimiters[np.minimum(first, len(delimiters) - 1)]
+        in_line = found & (candidates < ends)
+        ends[in_line] = candidates[in_line]
+
+    non_empty = ends > starts
+    return starts[non_empty], ends[non_empty]
+
+
+def iter_key_batches(path: str,
+                     delimiter: bytes = b',',
+                     chunk_bytes: int = CHUNK_BYTES,
+                     start: int = 0,
+                     end: int = None) -> Iterator[List[bytes]]:
+    '''
+    Yields batches of keys (bytes) from the first column of a file,
+    ready for the put_many/add_many batch APIs
+    '''
+    for chunk, _ in iter_chunks(path, chunk_bytes, start, end):
+        yield split_keys(chunk, delimiter)
+
+
+def iter_key_offset_batches(path: str,
+                            delimiter: bytes = b',',
+                            chunk_bytes: int = CHUNK_BYTES,
+                            start: int = 0,
+                            end: int = None) -> Iterator[Tuple[bytes, np.ndarray, np.ndarray]]:
+    '''
+    Same as iter_key_batches, but yields (buffer, starts, ends) offset arrays
+    into one buffer instead of separate key objects
+    '''
+    for chunk, _ in iter_chunks(path, chunk_bytes, start, end):
+        starts, ends = key_offsets(chunk, delimiter)
+        yield chunk, starts, ends
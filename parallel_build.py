@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from key_reader import iter_key_batches
+from task1 import BloomFilterNumpy
+from task2 import KBloomFilterNumpy
+from task4 import HyperLogLog
+from utils import gen_uniq_seq
+
+
+def split_file(path: str,
+               n_parts: int) -> List[Tuple[int, int]]:
+    '''
+    Splits a file into at most n_parts byte ranges [start, end)
+    with every boundary right after a newline
+    '''
+    file_size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n_parts):
+            position = file_size * i // n_parts - 1
+            if position < 0:
+                # Fewer bytes than parts, a boundary before the file start is just 0
+                boundaries.append(0)
+                continue
+            f.seek(position)
+            f.readline()
+            boundaries.append(min(f.tell(), file_size))
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def build_part(cls,
+               params: dict,
+               path: str,
+               start: int,
+               end: int) -> bytes:
+    '''
+    Builds a partial sketch over one byte range, returns it serialized
+    '''
+    sketch = cls(**params)
+    for keys in iter_key_batches(path, start=start, end=end):
+        sketch.put_many(keys)
+    return sketch.to_bytes()
+
+
+def build_serial(cls,
+                 path: str,
+                 **params):
+    '''
+    Builds a sketch over the whole file in the current process
+    '''
+    return cls.from_bytes(build_part(cls, params, path, 0, os.path.getsize(path)))
+
+
+def build_parallel(cls,
+                   path: str,
+                   n_workers: int = None,
+                   **params):
+    '''
+    Builds partial sketches over newline-aligned byte ranges in a process pool
+    and merges them (OR for Bloom filters, counter add for counting filters,
+    register max for HyperLogLog). The result is identical to `build_serial`.
+
+    cls: sketch class with put_many, merge, to_bytes and from_bytes
+    params: constructor arguments of cls
+    '''
+    n_workers = n_workers or os.cpu_count()
+    ranges = split_file(path, n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(build_part, cls, params, path, start, end)
+                   for start, end in ranges]
+        parts = [cls.from_bytes(future.result()) for future in futures]
+    if not parts:
+        return cls(**params)
+    result = parts[0]
+    for part in parts[1:]:
+        result.merge(part)
+    return result
+
+
+def run_build_benchmark(path: str,
+                        sketches: List,
+                        worker_counts: List):
+    '''
+    Times serial vs parallel builds and checks they are bit-identical
+    '''
+    results = []
+    for cls, params in sketches:
+        start = time.perf_counter()
+        serial = build_serial(cls, path, **params)
+        serial_time = time.perf_counter() - start
+        for n_workers in worker_counts:
+            start = time.perf_counter()
+            parallel = build_parallel(cls, path, n_workers=n_workers, **params)
+            parallel_time = time.perf_counter() - start
+            identical = parallel.to_bytes() == serial.to_bytes()
+            print(f'{cls.__name__}({params}), workers={n_workers}: serial {serial_time:.2f}s, '
+                  f'parallel {parallel_time:.2f}s, speedup {serial_time / parallel_time:.2f}x, '
+                  f'identical={identical}')
+            results.append({
+                'sketch' : cls.__name__,
+                'params' : params,
+                'n_workers' : n_workers,
+                'serial_time' : serial_time,
+                'parallel_time' : parallel_time,
+                'identical' : identical
+            })
+    return results
+
+
+if __name__ == '__main__':
+
+    sys.stdout.write('Generating test file\n')
+    gen_uniq_seq(name='5000000', n_records=5000000)
+
+    sketches = [
+        (BloomFilterNumpy, {'n' : 16777216}),
+        (KBloomFilterNumpy, {'n' : 16777216, 'k' : 3}),
+        (HyperLogLog, {'b' : 14, 'hash_bits' : 64})
+    ]
+    run_build_benchmark('5000000',
+                        sketches=sketches,
+                        worker_counts=[2, 4, os.cpu_count()])
@@ -0,0 +1,115 @@
+import struct
+from typing import Tuple
+
+import numpy as np
+
+MAGIC = b'SKCH'
+FORMAT_VERSION = 1
+
+# Sketch kinds stored in the header
+BLOOM = 1
+K_BLOOM = 2
+COUNTING_BLOOM = 3
+HYPER_LOG_LOG = 4
+BLOCKED_BLOOM = 5
+CUCKOO = 6
+
+# magic, format version, kind, hash version, reserved, 7 integer parameters
+HEADER = struct.Struct('<4sBBBB7Q')
+HEADER_SIZE = HEADER.size  # 64 bytes, keeps the payload 8-byte aligned
+MAX_PARAMS = 7
+
+
+def pack_header(kind: int,
+                hash_version: int,
+                *params: int) -> bytes:
+    '''
+    Builds the fixed-size header: sketch kind, hash scheme version and
+    the constructor parameters needed to rebuild the sketch
+    '''
+    if len(params) > MAX_PARAMS:
+        raise ValueError(f'At most {MAX_PARAMS} header parameters, got {len(params)}')
+    padded = tuple(params) + (0,) * (MAX_PARAMS - len(params))
+    return HEADER.pack(MAGIC, FORMAT_VERSION, kind, hash_version, 0, *padded)
+
+
+def unpack_header(data,
+                  kind: int,
+                  hash_version: int) -> Tuple[int, ...]:
+    '''
+    Validates the header against the expected kind and hash version,
+    returns the 7 stored parameters
+    '''
+    if len(data) < HEADER_SIZE:
+        raise ValueError('Data is too short to contain a sketch header')
+    magic, format_version, stored_kind, stored_hash_version, _, *params = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a serialized sketch (bad magic)')
+    if format_version != FORMAT_VERSION:
+        raise ValueError(f'Unsupported format version {format_version}')
+    if stored_kind != kind:
+        raise ValueError(f'Expected sketch kind {kind}, got {stored_kind}')
+    if stored_hash_version != hash_version:
+        raise ValueError(f'Sketch was built with hash version {stored_hash_version}, '
+                         f'this build uses {hash_version}')
+    return tuple(params)
+
+
+def pack(header: bytes,
+         array: np.ndarray) -> bytes:
+    '''
+    Header followed by the raw little-endian array payload
+    '''
+    return header + array.astype(array.dtype.newbyteorder('<'), copy=False).tobytes()
+
+
+def unpack_array(data,
+                 dtype) -> np.ndarray:
+    '''
+    Writable copy of the payload that follows the header
+    '''
+    return np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder('<'),
+                         offset=HEADER_SIZE).astype(dtype)
+
+
+def save(path: str,
+         data: bytes) -> None:
+    '''
+    Writes a serialized sketch to disk, the payload stays 8-byte aligned
+    so it can be opened with `open_payload` without copying
+    '''
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read_header(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read(HEADER_SIZE)
+
+
+def open_payload(path: str,
+                 dtype,
+                 mode: str = 'r') -> np.memmap:
+    '''
+    Maps the payload of a saved sketch into memory.
+    mode 'r' is read-only, 'c' is copy-on-write (writes stay private to the process),
+    'r+' writes through to the file. Pages are shared between processes
+    through the page cache, so opening is near-instant and costs no per-process copy.
+    '''
+    return np.memmap(path, dtype=np.dtype(dtype).newbyteorder('<'),
+                     mode=mode, offset=HEADER_SIZE)
+
+
+def check_compatible(sketch,
+                     other,
+                     *attributes: str) -> None:
+    '''
+    Raises ValueError unless both sketches have the same type and parameters
+    '''
+    if type(sketch) is not type(other):
+        raise ValueError(f'Cannot merge {type(sketch).__name__} with {type(other).__name__}')
+    for attribute in attributes:
+        if getattr(sketch, attribute) != getattr(other, attribute):
+            raise ValueError(f'Cannot merge sketches with different {attribute}: '
+                             f'{getattr(sketch, attribute)} != {getattr(other, attribute)}')
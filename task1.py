@@ -4,37 +4,95 @@ from typing import List
 from tqdm import tqdm
 import pandas as pd
 import sys
+import copy
 
 import os
 
+from bitset import bit_words, set_bit, test_bit, set_bits, test_bits, count_bits
+from key_reader import iter_key_batches
 from utils import gen_uniq_seq
+import serialization
+
+HASH_VERSION = 1  # mmh3.hash modulo n
+SEED = 0
 
 class BloomFilterNumpy:
     '''
     Bloom-filter using numpy bit array
+    packed into uint64 words (one bit per position)
     '''
     def __init__(self,
                  n: int):
         self.n = n
-        self.bit_array = np.zeros(n, dtype=bool)  # Use a numpy array of booleans
+        self.bit_array = bit_words(n)  # Packed bits, 64 per uint64 word
 
     def _hash(self, s):
         # Generate a single hash value for the given input
-        return mmh3.hash(s, 0) % self.n
+        return mmh3.hash(s, SEED) % self.n
 
     def put(self, s):
         # Set the bit corresponding to the hash value
         hash_value = self._hash(s)
-        self.bit_array[hash_value] = True
+        set_bit(self.bit_array, hash_value)
 
     def get(self, s):
         # Check if the bit corresponding to the hash value is set
         hash_value = self._hash(s)
-        return self.bit_array[hash_value]
+        return test_bit(self.bit_array, hash_value)
+
+    def _hash_many(self, keys):
+        # Same hash as _hash for a batch of keys
+        return np.fromiter((mmh3.hash(s, SEED) for s in keys), dtype=np.int64) % self.n
+
+    def put_many(self, keys):
+        set_bits(self.bit_array, self._hash_many(keys))
+
+    def get_many(self, keys):
+        return test_bits(self.bit_array, self._hash_many(keys))
+
+    def update_many(self, keys):
+        # Uses its own 32-bit hash, so there is no update_pairs
+        self.put_many(keys)
 
     def size(self):
         # Count the number of set bits in the bit array
-        return np.sum(self.bit_array)
+        return count_bits(self.bit_array)
+
+    def merge(self, other):
+        # In-place union with a filter of the same size
+        serialization.check_compatible(self, other, 'n')
+        self.bit_array |= other.bit_array
+        return self
+
+    def __or__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    def to_bytes(self) -> bytes:
+        header = serialization.pack_header(serialization.BLOOM, HASH_VERSION, self.n, SEED)
+        return serialization.pack(header, self.bit_array)
+
+    @classmethod
+    def _from_header(cls, header):
+        n, seed, *_ = serialization.unpack_header(header, serialization.BLOOM, HASH_VERSION)
+        if seed != SEED:
+            raise ValueError(f'Filter was built with seed {seed}, expected {SEED}')
+        return cls(n)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bf = cls._from_header(data)
+        bf.bit_array = serialization.unpack_array(data, np.uint64)
+        return bf
+
+    def save(self, path: str):
+        serialization.save(path, self.to_bytes())
+
+    @classmethod
+    def open(cls, path: str, mode: str = 'r'):
+        # Memory-mapped filter, see serialization.open_payload for modes
+        bf = cls._from_header(serialization.read_header(path))
+        bf.bit_array = serialization.open_payload(path, np.uint64, mode)
+        return bf
     
 def run(bf_sizes: List,
         set_sizes: List):
@@ -56,12 +114,12 @@ def run(bf_sizes: List,
 
             fp_count = 0
 
-            with open(f'{set_size}') as file: 
-                for line in file:
-                    if bf.get(line):
+            for keys in iter_key_batches(f'{set_size}'):
+                for key in keys:
+                    if bf.get(key):
                         fp_count += 1
-                    bf.put(line)
-                ones_count_int = bf.size()
+                    bf.put(key)
+            ones_count_int = bf.size()
 
             result_np.append(
                 {
@@ -1,38 +1,341 @@
 import numpy as np
-import mmh3
 from typing import List
 from tqdm import tqdm
 import pandas as pd
 import sys
 import os
+import time
+import copy
+import math
+
+from bitset import aligned_bit_words, bit_words, set_bit, test_bit, set_bits, test_bits, count_bits
+from hashing import (HASH_VERSION, SEED_SCHEME, hash_pairs, indices_from_pairs, item_indices,
+                     item_pair, pair_indices)
+from key_reader import iter_key_batches
+from utils import gen_uniq_seq, make_keys
+import serialization
+
+def optimal_params(expected_items: int,
+                   target_fpr: float) -> tuple:
+    """
+    Bit count and number of hash functions for a filter holding `expected_items`
+    keys at a false positive rate of at most `target_fpr`.
+
+    The optimal m = -N ln p / ln^2 2 is rounded up to a power of two, so indices
+    are taken with a mask instead of %. k = -log2 p is the optimum for the
+    unrounded m: the extra bits only lower the rate, without costing more hashes.
+    """
+    if expected_items <= 0:
+        raise ValueError('expected_items must be positive')
+    if not 0 < target_fpr < 1:
+        raise ValueError('target_fpr must be in (0, 1)')
+    bits = -expected_items * math.log(target_fpr) / math.log(2) ** 2
+    n = 1 << max(math.ceil(bits) - 1, 1).bit_length()
+    k = max(1, round(-math.log2(target_fpr)))
+    return n, k
 
-from utils import gen_uniq_seq
 
 class KBloomFilterNumpy:
+    KIND = serialization.K_BLOOM
+
     def __init__(self,
                  n: int,
                  k: int):
         """
         Bloom filter with k hash funcs
-        implemented with numpy
+        implemented with numpy, bits packed into uint64 words
         """
         self.n = n
         self.k = k
-        self.bit_array = np.zeros(n, dtype=bool)
+        self.bit_array = bit_words(n)
+
+    @classmethod
+    def for_capacity(cls,
+                     expected_items: int,
+                     target_fpr: float):
+        """
+        Filter sized for `expected_items` keys at `target_fpr`, see optimal_params
+        """
+        n, k = optimal_params(expected_items, target_fpr)
+        return cls(n=n, k=k)
 
     def _hashes(self, item):
-        return [mmh3.hash(item, seed) % self.n for seed in range(self.k)]
+        # Double hashing on one 128-bit hash, same scheme as hash_indices
+        return item_indices(item, self.k, self.n)
 
     def put(self, item):
         for hash_value in self._hashes(item):
-            self.bit_array[hash_value] = True
+            set_bit(self.bit_array, hash_value)
 
     def get(self, item):
-        return all(self.bit_array[hash_value] for hash_value in self._hashes(item))
+        return all(test_bit(self.bit_array, hash_value) for hash_value in self._hashes(item))
+
+    def _pair_indices(self, pairs):
+        # Same indices as _hashes for a batch of (h1, h2) pairs, shape (n_keys, k)
+        return indices_from_pairs(pairs, self.k, self.n)
+
+    def _hash_many(self, keys):
+        return self._pair_indices(hash_pairs(keys))
+
+    def put_many(self, keys):
+        """Insert a batch of keys with a single vectorized bit set."""
+        self.put_pairs(hash_pairs(keys))
+
+    def put_pairs(self, pairs):
+        """put_many for keys already hashed with hashing.hash_pairs."""
+        set_bits(self.bit_array, self._pair_indices(pairs))
+
+    def update_many(self, keys):
+        self.put_many(keys)
+
+    def update_pairs(self, pairs):
+        self.put_pairs(pairs)
+
+    def get_many(self, keys) -> np.ndarray:
+        """Check a batch of keys, returns a boolean array."""
+        return test_bits(self.bit_array, self._hash_many(keys)).all(axis=1)
 
     def size(self):
-        return np.sum(self.bit_array) / self.k
-    
+        return count_bits(self.bit_array) / self.k
+
+    def fill_ratio(self) -> float:
+        """Share of bits set."""
+        return count_bits(self.bit_array) / self.n
+
+    def current_fpr(self) -> float:
+        """
+        False positive rate at the current fill: a missing key hits k set bits
+        with probability fill_ratio ** k
+        """
+        return self.fill_ratio() ** self.k
+
+    def merge(self, other):
+        """In-place union with a filter built with the same n and k."""
+        serialization.check_compatible(self, other, 'n', 'k')
+        self.bit_array |= other.bit_array
+        return self
+
+    def __or__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    def to_bytes(self) -> bytes:
+        header = serialization.pack_header(self.KIND, HASH_VERSION,
+                                           self.n, self.k, SEED_SCHEME)
+        return serialization.pack(header, self.bit_array)
+
+    @classmethod
+    def _from_header(cls, header):
+        n, k, seed_scheme, *_ = serialization.unpack_header(header, cls.KIND, HASH_VERSION)
+        if seed_scheme != SEED_SCHEME:
+            raise ValueError(f'Filter was built with seed scheme {seed_scheme}, '
+                             f'expected {SEED_SCHEME}')
+        return cls(n=n, k=k)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bf = cls._from_header(data)
+        bf.bit_array = serialization.unpack_array(data, np.uint64)
+        return bf
+
+    def save(self, path: str):
+        """Write the filter to disk so it can be opened with `open`."""
+        serialization.save(path, self.to_bytes())
+
+    @classmethod
+    def open(cls, path: str, mode: str = 'r'):
+        """
+        Open a saved filter with np.memmap instead of loading it.
+        mode 'r' is read-only, 'c' is copy-on-write, 'r+' writes through to the file.
+        """
+        bf = cls._from_header(serialization.read_header(path))
+        bf.bit_array = serialization.open_payload(path, np.uint64, mode)
+        return bf
+
+
+class BlockedBloomFilterNumpy(KBloomFilterNumpy):
+    KIND = serialization.BLOCKED_BLOOM
+    BLOCK_BITS = 512  # One 64-byte cache line
+
+    def __init__(self,
+                 n: int,
+                 k: int):
+        """
+        Blocked Bloom filter: h1 picks one block of min(512, n) bits,
+        all k bits of the key are set inside it, so a lookup touches
+        a single cache line instead of k random ones.
+        Positions in the block are (g1 + i * g2) mod block_bits with g1, g2
+        the halves of h2, g2 odd so the k positions are distinct.
+
+        Costs a slightly higher FPR than KBloomFilterNumpy at the same n and k,
+        since keys aren't spread evenly between blocks.
+        """
+        self.block_bits = min(self.BLOCK_BITS, n)
+        if n % self.block_bits or self.block_bits & (self.block_bits - 1):
+            raise ValueError(f'n must be a multiple of {self.BLOCK_BITS} or a power of two below it')
+        super().__init__(n=n, k=k)
+        self.n_blocks = n // self.block_bits
+        self.bit_array = aligned_bit_words(n)
+
+    def _realigned(self, words: np.ndarray) -> np.ndarray:
+        """Copy of words on a cache line boundary, plain copies lose the alignment."""
+        aligned = aligned_bit_words(self.n)
+        aligned[:] = words
+        return aligned
+
+    @classmethod
+    def from_bytes(cls, data):
+        bf = cls._from_header(data)
+        bf.bit_array = bf._realigned(serialization.unpack_array(data, np.uint64))
+        return bf
+
+    def __deepcopy__(self, memo):
+        bf = object.__new__(type(self))
+        bf.__dict__.update(self.__dict__)
+        bf.bit_array = self._realigned(self.bit_array)
+        return bf
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bit_array = self._realigned(self.bit_array)
+
+    def _hashes(self, item):
+        h1, h2 = item_pair(item)
+        base = (h1 % self.n_blocks) * self.block_bits
+        g1, g2 = h2 & 0xFFFFFFFF, (h2 >> 32) | 1
+        mask = self.block_bits - 1
+        return [base + ((g1 + i * g2) & mask) for i in range(self.k)]
+
+    def _pair_indices(self, pairs):
+        base = pairs[:, :1] % np.uint64(self.n_blocks) * np.uint64(self.block_bits)
+        g1 = pairs[:, 1:] & np.uint64(0xFFFFFFFF)
+        g2 = (pairs[:, 1:] >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.k, dtype=np.uint64)
+        return base + ((g1 + steps * g2) & np.uint64(self.block_bits - 1))
+
+    def current_fpr(self) -> float:
+        """
+        A missing key falls into one block and hits k of its bits,
+        so average fill ** k over the blocks
+        """
+        if self.n_blocks == 1:
+            return super().current_fpr()
+        words_per_block = self.block_bits // 64
+        block_fill = np.bitwise_count(self.bit_array).reshape(-1, words_per_block).sum(axis=1) \
+            / self.block_bits
+        return float(np.mean(block_fill ** self.k))
+
+
+class ScalableBloomFilter:
+    def __init__(self,
+                 initial_capacity: int,
+                 target_fpr: float,
+                 growth: int = 2,
+                 tightening: float = 0.5,
+                 fill_limit: float = 0.5):
+        """
+        Scalable Bloom filter: a chain of KBloomFilterNumpy slices that grows
+        with the key set instead of being rebuilt.
+
+        Slice i is sized for initial_capacity * growth^i keys at
+        target_fpr * (1 - tightening) * tightening^i, so the rates sum to at most
+        target_fpr. Keys go to the last slice, a new one is added before its share
+        of set bits could pass fill_limit. A key is present if any slice has it.
+
+        Parameters:
+        initial_capacity (int): Expected number of keys in the first slice.
+        target_fpr (float): Bound on the false positive rate of the whole chain.
+        growth (int): Capacity multiplier between consecutive slices.
+        tightening (float): FPR multiplier between consecutive slices, in (0, 1).
+        fill_limit (float): Share of set bits at which a slice is closed.
+        """
+        if not 0 < tightening < 1:
+            raise ValueError('tightening must be in (0, 1)')
+        self.initial_capacity = initial_capacity
+        self.target_fpr = target_fpr
+        self.growth = growth
+        self.tightening = tightening
+        self.fill_limit = fill_limit
+        self.slices = []
+        self._headroom = 0
+        self._add_slice()
+
+    def _add_slice(self):
+        i = len(self.slices)
+        capacity = self.initial_capacity * self.growth ** i
+        fpr = self.target_fpr * (1 - self.tightening) * self.tightening ** i
+        self.slices.append(KBloomFilterNumpy.for_capacity(capacity, fpr))
+        self._headroom = self._slice_headroom(self.slices[-1])
+
+    def _slice_headroom(self, bf):
+        # Every key sets at most k new bits, so this many keys
+        # can't take the slice past fill_limit
+        return int((self.fill_limit * bf.n - count_bits(bf.bit_array)) // bf.k)
+
+    def _reserve(self):
+        """Keys the last slice can still take, opening a new slice when it's full."""
+        if self._headroom <= 0:
+            self._headroom = self._slice_headroom(self.slices[-1])
+            if self._headroom <= 0:
+                self._add_slice()
+        return self._headroom
+
+    def put(self, item):
+        self._reserve()
+        self.slices[-1].put(item)
+        self._headroom -= 1
+
+    def get(self, item):
+        h1, h2 = item_pair(item)
+        return any(all(test_bit(bf.bit_array, index) for index in pair_indices(h1, h2, bf.k, bf.n))
+                   for bf in self.slices)
+
+    def put_many(self, keys):
+        """Insert a batch of keys, hashed once and split between slices as they fill."""
+        self.put_pairs(hash_pairs(keys))
+
+    def put_pairs(self, pairs):
+        """put_many for keys already hashed with hashing.hash_pairs."""
+        start = 0
+        while start < len(pairs):
+            end = min(len(pairs), start + self._reserve())
+            bf = self.slices[-1]
+            set_bits(bf.bit_array, indices_from_pairs(pairs[start:end], bf.k, bf.n))
+            self._headroom -= end - start
+            start = end
+
+    def update_many(self, keys):
+        self.put_many(keys)
+
+    def update_pairs(self, pairs):
+        self.put_pairs(pairs)
+
+    def get_many(self, keys) -> np.ndarray:
+        """
+        Check a batch of keys, returns a boolean array. Keys are hashed once,
+        each slice only tests the keys not found in the previous ones.
+        """
+        pairs = hash_pairs(keys)
+        found = np.zeros(len(pairs), dtype=bool)
+        for bf in self.slices:
+            pending = np.flatnonzero(~found)
+            if not len(pending):
+                break
+            indices = indices_from_pairs(pairs[pending], bf.k, bf.n)
+            found[pending] = test_bits(bf.bit_array, indices).all(axis=1)
+        return found
+
+    def size(self):
+        return sum(bf.size() for bf in self.slices)
+
+    def current_fpr(self) -> float:
+        """False positive rate at the current fill: a key is a false positive in any slice."""
+        return 1 - np.prod([1 - bf.current_fpr() for bf in self.slices])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(bf.bit_array.nbytes for bf in self.slices)
+
+
 def run(bf_sizes: List,
         set_sizes: List,
         k_values: List):
@@ -63,12 +366,12 @@ def run(bf_sizes: List,
 
                 fp_count = 0
 
-                with open(f'{set_size}') as file: 
-                    for line in file:
-                        if bf.get(line):
+                for keys in iter_key_batches(f'{set_size}'):
+                    for key in keys:
+                        if bf.get(key):
                             fp_count += 1
-                        bf.put(line)
-                    ones_count_int = bf.size()
+                        bf.put(key)
+                ones_count_int = bf.size()
 
                 result_np_k.append(
                     {
@@ -81,7 +384,117 @@ def run(bf_sizes: List,
                 )
     
     return result_np_k
-    
+
+
+def run_batch_benchmark(bf_size: int,
+                        set_size: int,
+                        k: int):
+    """
+    Compares keys/sec of the per-item loop from `run` with put_many/get_many
+    """
+    keys = [key for batch in iter_key_batches(f'{set_size}') for key in batch]
+
+    bf = KBloomFilterNumpy(n=bf_size, k=k)
+    start = time.perf_counter()
+    for key in keys:
+        bf.get(key)
+        bf.put(key)
+    loop_time = time.perf_counter() - start
+
+    bf_batch = KBloomFilterNumpy(n=bf_size, k=k)
+    start = time.perf_counter()
+    bf_batch.get_many(keys)
+    bf_batch.put_many(keys)
+    batch_time = time.perf_counter() - start
+
+    assert np.array_equal(bf.bit_array, bf_batch.bit_array)
+
+    print(f'k={k}, bf_size={bf_size}, set_size={set_size}')
+    print(f'  per-item loop: {len(keys) / loop_time:,.0f} keys/sec')
+    print(f'  batched:       {len(keys) / batch_time:,.0f} keys/sec')
+
+    return {
+        'k' : k,
+        'bf_size' : bf_size,
+        'set_size' : set_size,
+        'loop_keys_per_sec' : len(keys) / loop_time,
+        'batch_keys_per_sec' : len(keys) / batch_time
+    }
+
+
+def run_blocked_benchmark(bf_sizes: List,
+                          set_sizes: List,
+                          k_values: List,
+                          n_queries: int = 100000,
+                          scalar_queries: int = 10000):
+    """
+    Query latency and FPR of BlockedBloomFilterNumpy against KBloomFilterNumpy
+    on the `run` grid. Both are filled from the same test file and queried with
+    keys that were never inserted, batched (get_many) and one by one (get).
+    """
+    queries = make_keys(n_queries, 0)
+    result = []
+    for k in k_values:
+        for bf_size in bf_sizes:
+            for set_size in set_sizes:
+                for cls in (KBloomFilterNumpy, BlockedBloomFilterNumpy):
+                    bf = cls(n=bf_size, k=k)
+                    for keys in iter_key_batches(f'{set_size}'):
+                        bf.put_many(keys)
+
+                    start = time.perf_counter_ns()
+                    fp_count = int(bf.get_many(queries).sum())
+                    batch_ns = (time.perf_counter_ns() - start) / len(queries)
+
+                    start = time.perf_counter_ns()
+                    for key in queries[:scalar_queries]:
+                        bf.get(key)
+                    scalar_ns = (time.perf_counter_ns() - start) / scalar_queries
+
+                    result.append(
+                        {
+                            'layout' : cls.__name__,
+                            'k' : k,
+                            'bf_size' : bf_size,
+                            'set_size' : set_size,
+                            'fpr' : fp_count / len(queries),
+                            'current_fpr' : bf.current_fpr(),
+                            'get_many_ns_per_key' : batch_ns,
+                            'get_ns_per_key' : scalar_ns
+                        }
+                    )
+    return result
+
+
+def run_scalable(set_sizes: List,
+                 initial_capacity: int,
+                 target_fpr: float):
+    """
+    Fills a ScalableBloomFilter that starts far too small with every test file,
+    counting false positives the same way as `run` (check each key, then insert it)
+    """
+    result = []
+    for set_size in set_sizes:
+        bf = ScalableBloomFilter(initial_capacity=initial_capacity,
+                                 target_fpr=target_fpr)
+        fp_count = 0
+        for keys in iter_key_batches(f'{set_size}'):
+            fp_count += int(bf.get_many(keys).sum())
+            bf.put_many(keys)
+
+        result.append(
+            {
+                'initial_capacity' : initial_capacity,
+                'target_fpr' : target_fpr,
+                'set_size' : set_size,
+                'fp_count' : fp_count,
+                'n_slices' : len(bf.slices),
+                'bytes' : bf.nbytes,
+                'current_fpr' : bf.current_fpr()
+            }
+        )
+    return result
+
 
 if __name__ == '__main__':
     
@@ -97,4 +510,23 @@ if __name__ == '__main__':
     result_df = pd.DataFrame(result_np)
     result_df.to_csv('results/k_df.csv')
     
-    print(result_df)
\ No newline at end of file
+    print(result_df)
+
+    for k in k_values:
+        run_batch_benchmark(bf_size=16777216,
+                            set_size=5000000,
+                            k=k)
+
+    blocked_df = pd.DataFrame(run_blocked_benchmark(bf_sizes=bf_sizes,
+                                                    set_sizes=set_sizes,
+                                                    k_values=k_values))
+    blocked_df.to_csv('results/blocked_df.csv')
+
+    print(blocked_df)
+
+    scalable_df = pd.DataFrame(run_scalable(set_sizes=set_sizes,
+                                            initial_capacity=1000,
+                                            target_fpr=0.01))
+    scalable_df.to_csv('results/scalable_df.csv')
+
+    print(scalable_df)
\ No newline at end of file
@@ -1,12 +1,18 @@
 import numpy as np
-import mmh3
 from typing import List
 from tqdm import tqdm
 import pandas as pd
 import sys
 import os
+import copy
+import math
+import random
+import time
 
-from utils import gen_uniq_seq
+from hashing import HASH_VERSION, hash_indices, hash_pairs, indices_from_pairs, item_indices, item_pair
+from key_reader import iter_key_batches
+from utils import gen_uniq_seq, make_keys
+import serialization
 
 class CountingBloomFilter:
     def __init__(self,
@@ -22,6 +28,7 @@ class CountingBloomFilter:
         self.k = k
         self.n = n
         self.cap = cap
+        self.mask = (1 << cap) - 1
 
         # Calculate the number of counters that fit into a 64-bit integer
         counters_per_int = 64 // cap
@@ -35,8 +42,8 @@ class CountingBloomFilter:
         self.bit_array = np.zeros(num_ints, dtype=np.uint64)
 
     def _hashes(self, item):
-        """Generate k hash values for the item using different seeds."""
-        return [mmh3.hash(item, seed) % self.n for seed in range(self.k)]
+        """Generate k hash values for the item by double hashing."""
+        return item_indices(item, self.k, self.n)
 
     def _get_counter_index_and_offset(self, hash_value):
         """Calculate the index and bit offset for the given hash value."""
@@ -66,17 +73,464 @@ class CountingBloomFilter:
                 return False
         return True
 
+    def _locate(self, counter_indices):
+        """Vectorized _get_counter_index_and_offset for an array of counters."""
+        counters_per_int = np.uint64(self.counters_per_int)
+        int_indices = counter_indices // counters_per_int
+        bit_offsets = (counter_indices % counters_per_int) * np.uint64(self.cap)
+        return int_indices, bit_offsets
+
+    def _read_counters(self, counter_indices):
+        """Extract the counters at the given indices (any shape)."""
+        int_indices, bit_offsets = self._locate(counter_indices)
+        return (self.bit_array[int_indices] >> bit_offsets) & np.uint64(self.mask)
+
+    def _write_counters(self, counter_indices, values):
+        """
+        Overwrite counters with new values.
+        Indices must be unique, counters sharing a word are handled by ufunc.at.
+        """
+        int_indices, bit_offsets = self._locate(counter_indices)
+        np.bitwise_and.at(self.bit_array, int_indices, ~(np.uint64(self.mask) << bit_offsets))
+        np.bitwise_or.at(self.bit_array, int_indices, values << bit_offsets)
+
+    def put_many(self, keys):
+        """Insert a batch of keys with saturating array increments."""
+        self.put_pairs(hash_pairs(keys))
+
+    def put_pairs(self, pairs):
+        """put_many for keys already hashed with hashing.hash_pairs."""
+        counter_indices, counts = np.unique(indices_from_pairs(pairs, self.k, self.n),
+                                            return_counts=True)
+        current = self._read_counters(counter_indices)
+        updated = np.minimum(current + counts.astype(np.uint64), np.uint64(self.mask))
+        self._write_counters(counter_indices, updated)
+
+    def update_many(self, keys):
+        self.put_many(keys)
+
+    def update_pairs(self, pairs):
+        self.put_pairs(pairs)
+
+    def get_many(self, keys) -> np.ndarray:
+        """Check a batch of keys, returns a boolean array."""
+        counters = self._read_counters(hash_indices(keys, self.k, self.n))
+        return (counters != 0).all(axis=1)
+
+    def remove(self, item):
+        """
+        Remove an item from the Counting Bloom Filter.
+        Items that are not in the filter are left untouched, saturated counters
+        are sticky (never decremented) so other items can't become false negatives.
+        Returns True if the item was present.
+        """
+        if not self.get(item):
+            return False
+        for hash_value in self._hashes(item):
+            int_index, bit_offset = self._get_counter_index_and_offset(hash_value)
+            current_count = (self.bit_array[int_index] >> bit_offset) & self.mask
+            if 0 < current_count < self.mask:
+                self.bit_array[int_index] -= (1 << bit_offset)
+        return True
+
+    def remove_many(self, keys) -> np.ndarray:
+        """
+        Remove a batch of keys, same rules as remove.
+        Membership is checked against the filter state before the batch.
+        Returns a boolean array of keys that were present.
+        """
+        counter_indices = hash_indices(keys, self.k, self.n)
+        present = (self._read_counters(counter_indices) != 0).all(axis=1)
+        counter_indices, counts = np.unique(counter_indices[present], return_counts=True)
+        current = self._read_counters(counter_indices)
+        mask = np.uint64(self.mask)
+        decremented = current - np.minimum(counts.astype(np.uint64), current)
+        self._write_counters(counter_indices, np.where(current == mask, mask, decremented))
+        return present
+
+    def _iter_counters(self, chunk_size: int = 1 << 20):
+        """Unpack counters chunk by chunk to keep the temporary matrix bounded."""
+        mask = np.uint64(self.mask)
+        shifts = np.arange(self.counters_per_int, dtype=np.uint64) * np.uint64(self.cap)
+        for start in range(0, self.num_ints, chunk_size):
+            words = self.bit_array[start:start + chunk_size, np.newaxis]
+            yield (words >> shifts) & mask
+
     def size(self):
         """Return the sum of all counters divided by k."""
-        mask = (1 << self.cap) - 1
-        total_count = 0
-        for int_index in range(self.num_ints):
-            value = self.bit_array[int_index]
-            for _ in range(self.counters_per_int):
-                total_count += value & mask
-                value >>= self.cap
+        total_count = sum(int(counters.sum()) for counters in self._iter_counters())
         return total_count / self.k
 
+    def _unpack_counters(self):
+        """All n counters as a flat array."""
+        return np.concatenate([counters.ravel() for counters in self._iter_counters()])[:self.n]
+
+    def _pack_counters(self, counters):
+        """Inverse of _unpack_counters, rebuilds the word array."""
+        padded = np.zeros(self.num_ints * self.counters_per_int, dtype=np.uint64)
+        padded[:self.n] = counters
+        shifts = np.arange(self.counters_per_int, dtype=np.uint64) * np.uint64(self.cap)
+        # Counters occupy disjoint bits, so the sum is the bitwise or
+        self.bit_array = (padded.reshape(self.num_ints, -1) << shifts).sum(axis=1, dtype=np.uint64)
+
+    def merge(self, other):
+        """
+        In-place merge with a filter built with the same k, n and cap.
+        Counters are added and saturate at their maximum.
+        """
+        serialization.check_compatible(self, other, 'k', 'n', 'cap')
+        total = self._unpack_counters() + other._unpack_counters()
+        self._pack_counters(np.minimum(total, np.uint64(self.mask)))
+        return self
+
+    def __or__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    def to_bytes(self) -> bytes:
+        header = serialization.pack_header(serialization.COUNTING_BLOOM, HASH_VERSION,
+                                           self.k, self.n, self.cap)
+        return serialization.pack(header, self.bit_array)
+
+    @classmethod
+    def from_bytes(cls, data):
+        k, n, cap, *_ = serialization.unpack_header(data, serialization.COUNTING_BLOOM,
+                                                    HASH_VERSION)
+        cbf = cls(k=k, n=n, cap=cap)
+        cbf.bit_array = serialization.unpack_array(data, np.uint64)
+        return cbf
+
+    def saturated_count(self):
+        """
+        Number of counters stuck at their maximum value.
+        A growing share means the filter should be rebuilt with more counters or bits.
+        """
+        return sum(int(np.count_nonzero(counters == self.mask))
+                   for counters in self._iter_counters())
+
+
+FINGERPRINT_MIX = 0x5BD1E995  # Spreads fingerprints over buckets for the alternate index
+
+
+class CuckooFilter:
+    def __init__(self,
+                 n: int,
+                 fingerprint_bits: int = 16,
+                 bucket_size: int = 4,
+                 max_kicks: int = 500):
+        """
+        Cuckoo filter: a key is stored as a small non-zero fingerprint in one of
+        its two candidate buckets, an n x bucket_size NumPy table.
+        Supports deletion without per-bit counters.
+
+        Bucket i1 = h1 mod n, fingerprint = h2 mod (2^f - 1) + 1.
+        The alternate bucket i2 = (mix(fp) - i1) mod n only needs the fingerprint
+        and the current bucket, and maps i2 back to i1, so fingerprints can be
+        moved without the key (partial-key cuckoo hashing) for any n.
+        If a chain of max_kicks evictions doesn't find room, the last evicted
+        fingerprint is kept aside and the filter counts as full.
+
+        Parameters:
+        n (int): Number of buckets.
+        fingerprint_bits (int): Bits per fingerprint, stored as uint8 up to 8, uint16 up to 16.
+        bucket_size (int): Fingerprints per bucket.
+        max_kicks (int): Longest eviction chain of a single insert.
+        """
+        if not 0 < fingerprint_bits <= 16:
+            raise ValueError('fingerprint_bits must be between 1 and 16')
+        self.n = n
+        self.fingerprint_bits = fingerprint_bits
+        self.bucket_size = bucket_size
+        self.max_kicks = max_kicks
+        self.fingerprint_max = (1 << fingerprint_bits) - 1
+        dtype = np.uint8 if fingerprint_bits <= 8 else np.uint16
+        self.table = np.zeros((n, bucket_size), dtype=dtype)
+        self.victim = None  # (bucket, fingerprint) that didn't fit
+        self._random = random.Random(0)
+
+    @classmethod
+    def for_capacity(cls,
+                     expected_items: int,
+                     target_fpr: float,
+                     bucket_size: int = 4,
+                     load_factor: float = 0.95):
+        """
+        Filter for `expected_items` keys at a false positive rate of at most
+        `target_fpr`: a query compares 2 * bucket_size fingerprints,
+        so f = log2(2 * bucket_size / target_fpr), rounded up to the storage width.
+        """
+        bits = math.ceil(math.log2(2 * bucket_size / target_fpr))
+        if bits > 16:
+            raise ValueError(f'target_fpr {target_fpr} needs more than 16-bit fingerprints')
+        n = max(1, math.ceil(expected_items / (bucket_size * load_factor)))
+        return cls(n=n, fingerprint_bits=8 if bits <= 8 else 16, bucket_size=bucket_size)
+
+    def _item(self, item):
+        h1, h2 = item_pair(item)
+        return h1 % self.n, h2 % self.fingerprint_max + 1
+
+    def _alt(self, bucket, fingerprint):
+        return (fingerprint * FINGERPRINT_MIX % self.n - bucket) % self.n
+
+    def _fingerprints(self, pairs):
+        """Vectorized _item: bucket and fingerprint arrays for a batch of (h1, h2) pairs."""
+        buckets = (pairs[:, 0] % np.uint64(self.n)).astype(np.int64)
+        fingerprints = pairs[:, 1] % np.uint64(self.fingerprint_max) + np.uint64(1)
+        return buckets, fingerprints.astype(self.table.dtype)
+
+    def _alt_many(self, buckets, fingerprints):
+        mixed = fingerprints.astype(np.uint64) * np.uint64(FINGERPRINT_MIX) % np.uint64(self.n)
+        return (mixed.astype(np.int64) - buckets) % self.n
+
+    def _victim_matches(self, buckets, alts, fingerprints):
+        if self.victim is None:
+            return np.zeros(len(buckets), dtype=bool)
+        bucket, fingerprint = self.victim
+        return (fingerprints == fingerprint) & ((buckets == bucket) | (alts == bucket))
+
+    def _free_slot(self, bucket):
+        row = self.table[bucket].tolist()
+        return row.index(0) if 0 in row else -1
+
+    def _insert(self, bucket, fingerprint):
+        """Insert one fingerprint, evicting others if both buckets are full."""
+        if self.victim is not None:
+            return False
+        for b in (bucket, self._alt(bucket, fingerprint)):
+            slot = self._free_slot(b)
+            if slot >= 0:
+                self.table[b, slot] = fingerprint
+                return True
+        b = self._random.choice((bucket, self._alt(bucket, fingerprint)))
+        for _ in range(self.max_kicks):
+            slot = int(self._random.random() * self.bucket_size)
+            fingerprint, self.table[b, slot] = int(self.table[b, slot]), fingerprint
+            b = self._alt(b, fingerprint)
+            slot = self._free_slot(b)
+            if slot >= 0:
+                self.table[b, slot] = fingerprint
+                return True
+        self.victim = (b, fingerprint)
+        return True
+
+    def _place(self, buckets, fingerprints):
+        """
+        Vectorized insert without evictions: puts as many fingerprints as fit
+        into free slots of the given buckets. Returns a boolean array of the placed ones.
+        """
+        order = np.argsort(buckets, kind='stable')
+        sorted_buckets = buckets[order]
+        unique_buckets, starts, counts = np.unique(sorted_buckets, return_index=True,
+                                                   return_counts=True)
+        group = np.repeat(np.arange(len(unique_buckets)), counts)
+        rank = np.arange(len(sorted_buckets)) - starts[group]
+
+        rows = self.table[unique_buckets]
+        free_slots = np.argsort(rows != 0, axis=1, kind='stable')  # Free slots first
+        fits = rank < (rows == 0).sum(axis=1)[group]
+        slots = free_slots[group[fits], rank[fits]]
+        self.table[sorted_buckets[fits], slots] = fingerprints[order][fits]
+
+        placed = np.zeros(len(buckets), dtype=bool)
+        placed[order[fits]] = True
+        return placed
+
+    def _relocate(self, buckets, fingerprints):
+        """
+        One vectorized eviction step for keys whose buckets are both full:
+        a fingerprint from one of them moves to its own alternate bucket
+        if that has room, and the key takes the freed slot.
+        Nothing is overwritten unless the move succeeded.
+        Returns a boolean array of the placed keys.
+        """
+        slots = np.arange(self.bucket_size)
+        alts = self._alt_many(buckets, fingerprints)
+        sources = np.concatenate([buckets[:, np.newaxis] * self.bucket_size + slots,
+                                  alts[:, np.newaxis] * self.bucket_size + slots], axis=1)
+        flat_table = self.table.reshape(-1)
+        residents = flat_table[sources]
+        targets = self._alt_many(sources.ravel() // self.bucket_size,
+                                 residents.ravel()).reshape(sources.shape)
+        has_room = (self.table[targets] == 0).any(axis=2)
+
+        rows = np.flatnonzero(has_room.any(axis=1))
+        choice = has_room[rows].argmax(axis=1)
+        # At most one key per source slot
+        _, first = np.unique(sources[rows, choice], return_index=True)
+        rows, choice = rows[first], choice[first]
+
+        moved = self._place(targets[rows, choice], residents[rows, choice])
+        flat_table[sources[rows[moved], choice[moved]]] = fingerprints[rows[moved]]
+        placed = np.zeros(len(buckets), dtype=bool)
+        placed[rows[moved]] = True
+        return placed
+
+    def _put_hashed(self, buckets, fingerprints):
+        pending = np.arange(len(buckets))
+        for candidates in (buckets, self._alt_many(buckets, fingerprints)):
+            if not len(pending):
+                break
+            pending = pending[~self._place(candidates[pending], fingerprints[pending])]
+        while len(pending):
+            placed = self._relocate(buckets[pending], fingerprints[pending])
+            if not placed.any():
+                break
+            pending = pending[~placed]
+        inserted = np.ones(len(buckets), dtype=bool)
+        for i in pending:
+            inserted[i] = self._insert(int(buckets[i]), int(fingerprints[i]))
+        return inserted
+
+    def put(self, item):
+        """
+        Insert an item. Returns False if the filter is full and the item wasn't added.
+        """
+        return self._insert(*self._item(item))
+
+    def put_many(self, keys) -> np.ndarray:
+        """
+        Insert a batch of keys: free slots in the first, then the second bucket
+        are filled with array ops, then single-step evictions are done with array ops
+        while they make progress, only the rest go through eviction chains one by one.
+        Returns a boolean array, False for keys that didn't fit.
+        """
+        return self.put_pairs(hash_pairs(keys))
+
+    def put_pairs(self, pairs) -> np.ndarray:
+        """put_many for keys already hashed with hashing.hash_pairs."""
+        return self._put_hashed(*self._fingerprints(pairs))
+
+    def update_many(self, keys):
+        self.put_many(keys)
+
+    def update_pairs(self, pairs):
+        self.put_pairs(pairs)
+
+    def get(self, item):
+        """Check if an item is in the Cuckoo Filter."""
+        bucket, fingerprint = self._item(item)
+        alt = self._alt(bucket, fingerprint)
+        return bool(fingerprint in self.table[bucket] or fingerprint in self.table[alt]
+                    or self.victim in ((bucket, fingerprint), (alt, fingerprint)))
+
+    def get_many(self, keys) -> np.ndarray:
+        """Check a batch of keys, returns a boolean array."""
+        buckets, fingerprints = self._fingerprints(hash_pairs(keys))
+        alts = self._alt_many(buckets, fingerprints)
+        column = fingerprints[:, np.newaxis]
+        return ((self.table[buckets] == column).any(axis=1)
+                | (self.table[alts] == column).any(axis=1)
+                | self._victim_matches(buckets, alts, fingerprints))
+
+    def _reinsert_victim(self):
+        if self.victim is not None:
+            bucket, fingerprint = self.victim
+            self.victim = None
+            self._insert(bucket, fingerprint)
+
+    def _remove(self, bucket, fingerprint):
+        alt = self._alt(bucket, fingerprint)
+        if self.victim in ((bucket, fingerprint), (alt, fingerprint)):
+            self.victim = None
+            return True
+        for b in (bucket, alt):
+            row = self.table[b].tolist()
+            if fingerprint in row:
+                self.table[b, row.index(fingerprint)] = 0
+                self._reinsert_victim()
+                return True
+        return False
+
+    def remove(self, item):
+        """
+        Remove one copy of an item. Only remove items that were put,
+        otherwise a key sharing the fingerprint can become a false negative.
+        Returns True if the item was present.
+        """
+        return self._remove(*self._item(item))
+
+    def remove_many(self, keys) -> np.ndarray:
+        """
+        Remove a batch of keys, same rules as remove.
+        Fingerprints of different keys are cleared with one array write,
+        keys that resolve to the same slot (repeated keys) one by one.
+        Returns a boolean array of keys that were present.
+        """
+        buckets, fingerprints = self._fingerprints(hash_pairs(keys))
+        alts = self._alt_many(buckets, fingerprints)
+        column = fingerprints[:, np.newaxis]
+        in_first = self.table[buckets] == column
+        in_second = self.table[alts] == column
+        has_first = in_first.any(axis=1)
+        present = has_first | in_second.any(axis=1)
+
+        slots = np.where(has_first, buckets, alts) * self.bucket_size \
+            + np.where(has_first, in_first.argmax(axis=1), in_second.argmax(axis=1))
+        found = np.flatnonzero(present)
+        _, first, counts = np.unique(slots[found], return_index=True, return_counts=True)
+        single = found[first[counts == 1]]
+        self.table.reshape(-1)[slots[single]] = 0
+
+        sequential = np.setdiff1d(found, single)
+        if self.victim is not None:
+            sequential = np.union1d(sequential, np.flatnonzero(~present))
+        for i in sequential:
+            present[i] = self._remove(int(buckets[i]), int(fingerprints[i]))
+        self._reinsert_victim()
+        return present
+
+    def size(self):
+        """Number of stored fingerprints, i.e. items put and not removed."""
+        return int(np.count_nonzero(self.table)) + (self.victim is not None)
+
+    def load_factor(self) -> float:
+        return self.size() / self.table.size
+
+    def current_fpr(self) -> float:
+        """
+        A missing key is compared with the fingerprints in its two buckets,
+        each matches with probability 1 / (2^f - 1)
+        """
+        compared = 2 * self.bucket_size * self.load_factor()
+        return 1 - (1 - 1 / self.fingerprint_max) ** compared
+
+    def merge(self, other):
+        """
+        In-place union with a filter built with the same n, fingerprint_bits and bucket_size.
+        Every fingerprint of `other` is inserted, raises ValueError if they don't fit.
+        """
+        serialization.check_compatible(self, other, 'n', 'fingerprint_bits', 'bucket_size')
+        buckets, slots = np.nonzero(other.table)
+        fingerprints = other.table[buckets, slots]
+        if other.victim is not None:
+            buckets = np.append(buckets, other.victim[0])
+            fingerprints = np.append(fingerprints, other.victim[1]).astype(self.table.dtype)
+        if not self._put_hashed(buckets.astype(np.int64), fingerprints).all():
+            raise ValueError('Filters are too full to be merged')
+        return self
+
+    def __or__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    def to_bytes(self) -> bytes:
+        victim_bucket, victim_fingerprint = self.victim or (0, 0)
+        header = serialization.pack_header(serialization.CUCKOO, HASH_VERSION,
+                                           self.n, self.fingerprint_bits, self.bucket_size,
+                                           self.max_kicks, self.victim is not None,
+                                           victim_bucket, victim_fingerprint)
+        return serialization.pack(header, self.table)
+
+    @classmethod
+    def from_bytes(cls, data):
+        n, fingerprint_bits, bucket_size, max_kicks, has_victim, victim_bucket, \
+            victim_fingerprint = serialization.unpack_header(data, serialization.CUCKOO,
+                                                             HASH_VERSION)
+        cf = cls(n=n, fingerprint_bits=fingerprint_bits, bucket_size=bucket_size,
+                 max_kicks=max_kicks)
+        cf.table = serialization.unpack_array(data, cf.table.dtype).reshape(n, bucket_size)
+        if has_victim:
+            cf.victim = (victim_bucket, victim_fingerprint)
+        return cf
+
 
 def cap_experiment(cap: int,
                    k: int,
@@ -91,30 +545,30 @@ def cap_experiment(cap: int,
                                                 n=bf_size)
     fp_count = 0
 
-    with open(f'cap_{set_size}.csv') as file: 
-        for line in file:
-            if counting_bloom_filter.get(line):
+    for keys in iter_key_batches(f'cap_{set_size}.csv'):
+        for key in keys:
+            if counting_bloom_filter.get(key):
                 fp_count += 1
-            counting_bloom_filter.put(line)
-        ones_count = counting_bloom_filter.size()
+            counting_bloom_filter.put(key)
+    ones_count = counting_bloom_filter.size()
 
     return fp_count, ones_count
 
+CAP_EXPERIMENTS = [
+    {"cap": 2, "k": 3, "bf_size": 65536, "set_size": 10000},
+    {"cap": 5, "k": 2, "bf_size": 8192, "set_size": 1000},
+    {"cap": 3, "k": 4, "bf_size": 32768, "set_size": 5000},
+    {"cap": 4, "k": 5, "bf_size": 32768, "set_size": 2000},
+    {"cap": 3, "k": 3, "bf_size": 16384, "set_size": 3000}  # 5-bit counter not directly specified in parameters
+]
+
 def run_cap_experiments():
     """
     Defines experiments with counting Bloom Filter
     """
-    experiments = [
-        {"cap": 2, "k": 3, "bf_size": 65536, "set_size": 10000},
-        {"cap": 5, "k": 2, "bf_size": 8192, "set_size": 1000},
-        {"cap": 3, "k": 4, "bf_size": 32768, "set_size": 5000},
-        {"cap": 4, "k": 5, "bf_size": 32768, "set_size": 2000},
-        {"cap": 3, "k": 3, "bf_size": 16384, "set_size": 3000}  # 5-bit counter not directly specified in parameters
-    ]
-
     results = []
 
-    for exp in experiments:
+    for exp in CAP_EXPERIMENTS:
         fp_count, ones_count = cap_experiment(
             cap=exp["cap"],
             k=exp["k"],
@@ -136,6 +590,51 @@ def run_cap_experiments():
 
     return results
 
+def run_cuckoo_comparison(target_fpr: float = 0.01,
+                          seed: int = 0):
+    """
+    Head-to-head of CountingBloomFilter and CuckooFilter on the CAP_EXPERIMENTS configs.
+    The counting filter is built as configured, the cuckoo filter is sized for
+    the same number of keys at target_fpr. Both get set_size keys, are queried
+    with set_size keys that were never inserted, then all keys are removed.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for exp in CAP_EXPERIMENTS:
+        set_size = exp["set_size"]
+        keys = make_keys(set_size, rng)
+        queries = make_keys(set_size, rng)
+        filters = {
+            "CountingBloomFilter": CountingBloomFilter(cap=exp["cap"], k=exp["k"], n=exp["bf_size"]),
+            "CuckooFilter": CuckooFilter.for_capacity(set_size, target_fpr)
+        }
+        for name, sketch in filters.items():
+            start = time.perf_counter_ns()
+            sketch.put_many(keys)
+            put_ns = time.perf_counter_ns() - start
+            start = time.perf_counter_ns()
+            fp_count = int(sketch.get_many(queries).sum())
+            get_ns = time.perf_counter_ns() - start
+            memory = sketch.bit_array.nbytes if name == "CountingBloomFilter" else sketch.table.nbytes
+            start = time.perf_counter_ns()
+            sketch.remove_many(keys)
+            remove_ns = time.perf_counter_ns() - start
+
+            results.append({
+                "filter": name,
+                "cap": exp["cap"],
+                "k": exp["k"],
+                "bf_size": exp["bf_size"],
+                "set_size": set_size,
+                "bits_per_key": memory * 8 / set_size,
+                "fpr": fp_count / set_size,
+                "left_after_remove": int(sketch.get_many(keys).sum()),
+                "put_ns_per_key": put_ns / set_size,
+                "get_ns_per_key": get_ns / set_size,
+                "remove_ns_per_key": remove_ns / set_size
+            })
+    return results
+
 if __name__ == '__main__':
 
     os.makedirs('results', exist_ok=True)
@@ -145,3 +644,6 @@ if __name__ == '__main__':
     results_df.to_csv('results/cap_df.csv')
     print(results_df)
 
+    comparison_df = pd.DataFrame(run_cuckoo_comparison())
+    comparison_df.to_csv('results/cuckoo_df.csv')
+    print(comparison_df)
@@ -1,14 +1,95 @@
 import math
-import mmh3
+import time
+import copy
+import numpy as np
 from utils import gen_grouped_seq
+from key_reader import iter_key_batches
 from typing import List
+import serialization
+from hashing import HASH_VERSION, hash_pairs, item_pair
+
+
+def bit_length(values: np.ndarray) -> np.ndarray:
+    """
+    Vectorized int.bit_length for an array of unsigned integers (up to 64 bits)
+    """
+    values = values.astype(np.uint64)
+    lengths = np.zeros(values.shape, dtype=np.uint8)
+    # Binary search on the highest set bit
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    lengths += (values > 0).astype(np.uint8)
+    return lengths
+
+
+SPARSE_PRECISION = 25  # Index bits of the sparse representation (p' in HLL++)
+RANK_BITS = 6  # Low bits of a sparse entry holding the rank
+
+
+def sigma(x: float) -> float:
+    # Series from Ertl, "New cardinality estimation algorithms for HyperLogLog sketches"
+    if x == 1.0:
+        return math.inf
+    y = 1.0
+    z = x
+    while True:
+        x *= x
+        z_old = z
+        z += x * y
+        y += y
+        if z == z_old:
+            return z
+
+
+def tau(x: float) -> float:
+    # Companion series to sigma for registers that hit the maximum rank
+    if x == 0.0 or x == 1.0:
+        return 0.0
+    y = 1.0
+    z = 1.0 - x
+    while True:
+        x = math.sqrt(x)
+        z_old = z
+        y *= 0.5
+        z -= (1.0 - x) ** 2 * y
+        if z == z_old:
+            return z / 3.0
+
 
 class HyperLogLog:
-    def __init__(self, b: int):
+    def __init__(self, b: int, hash_bits: int = 32, sparse: bool = False):
+        """
+        b: number of index bits, m = 2^b registers
+        hash_bits: 32 or 64 top bits of the shared 128-bit hash (h1), the 64-bit
+        mode doesn't need the large range correction near 2^32
+        sparse: HLL++ mode (needs hash_bits=64). While cardinality is small only
+        sorted (index, rank) pairs at precision SPARSE_PRECISION are kept, they are
+        converted to dense registers once they'd take more memory than the registers.
+        Dense estimates use the bias-corrected estimator instead of the raw one.
+        """
+        if hash_bits not in (32, 64):
+            raise ValueError(f'hash_bits must be 32 or 64, got {hash_bits}')
+        if sparse and hash_bits != 64:
+            raise ValueError('sparse mode requires hash_bits=64')
         self.b = b
         self.m = 1 << b  # m = 2^b
-        self.registers = [0] * self.m
+        self.hash_bits = hash_bits
+        self.plus_plus = sparse
         self.alpha_m = self.get_alpha_m(self.m)
+        if sparse:
+            self.registers = None
+            self.sparse_list = np.zeros(0, dtype=np.uint32)
+            self.sparse_buffer = []
+            # A sparse entry is 4 bytes, a dense register is 1 byte
+            self.sparse_threshold = self.m // 4
+        else:
+            self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    @property
+    def is_sparse(self):
+        return self.registers is None
 
     def get_alpha_m(self, m):
         # Constants for different m values
@@ -22,39 +103,193 @@ class HyperLogLog:
             return 0.7213 / (1 + 1.079 / m)
 
     def hash(self, value):
-        # Hash the value using MurmurHash and convert to a binary string
-        return mmh3.hash(value, signed=False)
+        # Top hash_bits of h1 from the shared 128-bit MurmurHash
+        return item_pair(value)[0] >> (64 - self.hash_bits)
 
     def rho(self, w):
-        # Position of the leftmost 1-bit in the binary representation of w
+        # Position of the leftmost 1-bit in w, a (hash_bits - b)-bit integer
         # Add 1 because we want the position starting from 1, not 0
-        return len(w) - len(w.lstrip('0')) + 1
+        return self.hash_bits - self.b - w.bit_length() + 1
 
     def put(self, item):
         x = self.hash(item)
-        # Convert the hash to binary and ensure it has enough bits
-        x_bin = bin(x)[2:].zfill(32)  
+
+        if self.is_sparse:
+            w_bits = self.hash_bits - SPARSE_PRECISION
+            w = x & ((1 << w_bits) - 1)
+            rank = w_bits - w.bit_length() + 1
+            self.sparse_buffer.append(((x >> w_bits) << RANK_BITS) | rank)
+            if len(self.sparse_buffer) >= min(1024, self.sparse_threshold):
+                self._flush_sparse()
+            return
+
+        w_bits = self.hash_bits - self.b
 
         # Use the first b bits for the register index
-        j = int(x_bin[:self.b], 2)
-        
+        j = x >> w_bits
+
         # Use the remaining bits to calculate the rank (rho)
-        w = x_bin[self.b:]
-        self.registers[j] = max(self.registers[j], self.rho(w))
+        w = x & ((1 << w_bits) - 1)
+        rank = self.rho(w)
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+    def put_hashes(self, hashes: np.ndarray):
+        """
+        Update registers from an array of precomputed hashes
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+
+        if self.is_sparse:
+            w_bits = self.hash_bits - SPARSE_PRECISION
+            w = hashes & np.uint64((1 << w_bits) - 1)
+            ranks = np.uint64(w_bits + 1) - bit_length(w)
+            entries = ((hashes >> np.uint64(w_bits)) << np.uint64(RANK_BITS)) | ranks
+            # Entries buffered by put go in with the batch
+            buffered = np.array(self.sparse_buffer, dtype=np.uint32)
+            self.sparse_buffer = []
+            self._merge_sparse(np.concatenate([buffered, entries.astype(np.uint32)]))
+            return
+
+        w_bits = self.hash_bits - self.b
+        j = hashes >> np.uint64(w_bits)
+        w = hashes & np.uint64((1 << w_bits) - 1)
+        ranks = np.uint8(w_bits + 1) - bit_length(w)
+        np.maximum.at(self.registers, j, ranks)
+
+    def put_many(self, keys):
+        """
+        Insert a batch of keys, registers are updated with np.maximum.at
+        """
+        self.put_pairs(hash_pairs(keys))
+
+    def put_pairs(self, pairs):
+        """put_many for keys already hashed with hashing.hash_pairs, only h1 is used."""
+        self.put_hashes(pairs[:, 0] >> np.uint64(64 - self.hash_bits))
+
+    def update_many(self, keys):
+        self.put_many(keys)
+
+    def update_pairs(self, pairs):
+        self.put_pairs(pairs)
+
+    def _flush_sparse(self):
+        buffer = np.array(self.sparse_buffer, dtype=np.uint32)
+        self.sparse_buffer = []
+        self._merge_sparse(buffer)
+
+    def _merge_sparse(self, entries: np.ndarray):
+        """
+        Merge new entries into the sorted sparse list, keeping the max rank per index.
+        Entries sort by index first and rank second, so the last entry of each index wins.
+        """
+        merged = np.unique(np.concatenate([self.sparse_list, entries]))
+        indices = merged >> np.uint32(RANK_BITS)
+        last = np.append(indices[1:] != indices[:-1], True)
+        self.sparse_list = merged[last]
+        if len(self.sparse_list) > self.sparse_threshold:
+            self._to_dense()
+
+    def _to_dense(self):
+        # Buffered entries aren't in sparse_list yet, duplicates are fine for the max
+        self.sparse_list = np.concatenate([self.sparse_list,
+                                           np.array(self.sparse_buffer, dtype=np.uint32)])
+        self.registers = self._sparse_registers()
+        self.sparse_list = None
+        self.sparse_buffer = None
+
+    def _sparse_registers(self):
+        """Convert sparse (index, rank) pairs at SPARSE_PRECISION to b-bit registers."""
+        extra_bits = SPARSE_PRECISION - self.b
+        indices = (self.sparse_list >> np.uint32(RANK_BITS)).astype(np.uint64)
+        sparse_ranks = (self.sparse_list & np.uint32((1 << RANK_BITS) - 1)).astype(np.uint8)
+        # Index bits beyond b are the leading bits of the dense rank word
+        low = indices & np.uint64((1 << extra_bits) - 1)
+        ranks = np.where(low != 0,
+                         np.uint8(extra_bits + 1) - bit_length(low),
+                         np.uint8(extra_bits) + sparse_ranks)
+        registers = np.zeros(self.m, dtype=np.uint8)
+        np.maximum.at(registers, indices >> np.uint64(extra_bits), ranks)
+        return registers
+
+    def merge(self, other):
+        """
+        In-place merge with a sketch of the same b, hash_bits and mode,
+        the result is the register-wise max (or the union of sparse entries).
+        """
+        serialization.check_compatible(self, other, 'b', 'hash_bits', 'plus_plus')
+        if other.is_sparse and other.sparse_buffer:
+            other._flush_sparse()
+        if self.is_sparse and self.sparse_buffer:
+            self._flush_sparse()
+        if self.is_sparse and other.is_sparse:
+            self._merge_sparse(other.sparse_list)
+            return self
+        if self.is_sparse:
+            self._to_dense()
+        other_registers = other._sparse_registers() if other.is_sparse else other.registers
+        np.maximum(self.registers, other_registers, out=self.registers)
+        return self
+
+    def __or__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    def to_bytes(self) -> bytes:
+        if self.is_sparse and self.sparse_buffer:
+            self._flush_sparse()
+        header = serialization.pack_header(serialization.HYPER_LOG_LOG, HASH_VERSION,
+                                           self.b, self.hash_bits,
+                                           int(self.plus_plus), int(self.is_sparse))
+        payload = self.sparse_list if self.is_sparse else self.registers
+        return serialization.pack(header, payload)
+
+    @classmethod
+    def from_bytes(cls, data):
+        b, hash_bits, plus_plus, is_sparse, *_ = serialization.unpack_header(
+            data, serialization.HYPER_LOG_LOG, HASH_VERSION)
+        hll = cls(b=b, hash_bits=hash_bits, sparse=bool(plus_plus))
+        if is_sparse:
+            hll.sparse_list = serialization.unpack_array(data, np.uint32)
+        else:
+            hll.registers = serialization.unpack_array(data, np.uint8)
+            hll.sparse_list = None
+            hll.sparse_buffer = None
+        return hll
+
+    def _improved_estimate(self):
+        """Bias-corrected estimator, no empirical bias tables needed."""
+        q = self.hash_bits - self.b
+        counts = np.bincount(self.registers, minlength=q + 2)
+        z = self.m * tau(1.0 - counts[q + 1] / self.m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + counts[k])
+        z += self.m * sigma(counts[0] / self.m)
+        return self.m * self.m / (2 * math.log(2) * z)
 
     def est_size(self):
+        if self.is_sparse:
+            if self.sparse_buffer:
+                self._flush_sparse()
+            if self.is_sparse:
+                # Linear counting over the 2^SPARSE_PRECISION sparse registers
+                m_sparse = 1 << SPARSE_PRECISION
+                return m_sparse * math.log(m_sparse / (m_sparse - len(self.sparse_list)))
+
+        if self.plus_plus:
+            return self._improved_estimate()
+
         # Calculate the harmonic mean of 2^-M[j]
-        Z = sum(2.0 ** -reg for reg in self.registers)
+        Z = float(np.sum(np.exp2(-self.registers.astype(np.float64))))
         E = self.alpha_m * self.m * self.m / Z
 
         # Apply small range correction
         if E <= 2.5 * self.m:
-            V = self.registers.count(0)
+            V = int(np.count_nonzero(self.registers == 0))
             if V > 0:
                 E = self.m * math.log(self.m / V)
 
-        # Apply large range correction
-        elif E > (1 / 30.0) * (1 << 32):
+        # Apply large range correction, only the 32-bit hash space saturates
+        elif self.hash_bits == 32 and E > (1 / 30.0) * (1 << 32):
             E = -(1 << 32) * math.log(1 - E / (1 << 32))
 
         return E
@@ -70,10 +305,8 @@ def run_experiment(pattern: List,
     hll = HyperLogLog(b=b)
 
     # Read the dataset and insert keys into HyperLogLog
-    with open(filename, 'r') as f:
-        for line in f:
-            key = line.strip().split(':')[0]
-            hll.put(key)
+    for keys in iter_key_batches(filename, delimiter=b':'):
+        hll.put_many(keys)
 
     # Estimate the size
     estimated_size = hll.est_size()
@@ -86,8 +319,55 @@ def run_experiment(pattern: List,
     print(f'Estimated size: {estimated_size}')
     print(f'Relative error: {relative_error:.4%}\n')
 
+def run_hash_benchmark(b: int,
+                       hash_bits: int,
+                       cardinalities: List,
+                       chunk_size: int = 10**7,
+                       seed: int = 0):
+    """
+    Feeds a synthetic stream of uniform random hashes into HyperLogLog
+    and reports relative error and throughput at each cardinality checkpoint.
+    Random 64-bit values stand in for distinct keys (collisions are negligible),
+    the 32-bit mode gets the top 32 bits of the same stream.
+    """
+    rng = np.random.default_rng(seed)
+    hll = HyperLogLog(b=b, hash_bits=hash_bits)
+    results = []
+    fed = 0
+    elapsed = 0.0
+    for cardinality in sorted(cardinalities):
+        while fed < cardinality:
+            batch = min(chunk_size, cardinality - fed)
+            hashes = rng.integers(0, np.iinfo(np.uint64).max, size=batch,
+                                  dtype=np.uint64, endpoint=True)
+            if hash_bits == 32:
+                hashes >>= np.uint64(32)
+            start = time.perf_counter()
+            hll.put_hashes(hashes)
+            elapsed += time.perf_counter() - start
+            fed += batch
+        estimated_size = hll.est_size()
+        result = {
+            'b' : b,
+            'hash_bits' : hash_bits,
+            'cardinality' : cardinality,
+            'estimated_size' : estimated_size,
+            'relative_error' : abs(estimated_size - cardinality) / cardinality,
+            'hashes_per_sec' : fed / elapsed
+        }
+        print(f"b={b}, hash_bits={hash_bits}, cardinality={cardinality:.0e}: "
+              f"estimate={estimated_size:.0f}, relative error={result['relative_error']:.4%}, "
+              f"{result['hashes_per_sec']:,.0f} hashes/sec")
+        results.append(result)
+    return results
+
 if __name__ == '__main__':
     # Run experiments with different sizes and patterns
     run_experiment(pattern=[(500, 1), (10, 100)], filename="grouped_seq_500.txt", true_size=510, b=14)
     run_experiment(pattern=[(40000, 1), (100, 100)], filename="grouped_seq_50000.txt", true_size=40100, b=14)
     run_experiment(pattern=[(4000000, 1), (1000, 1000)], filename="grouped_seq_5000000.txt", true_size=4001000, b=18)
+
+    # Error and throughput of 32-bit vs 64-bit hashing from 1e3 to 1e9 distinct keys
+    cardinalities = [10**3, 10**4, 10**5, 10**6, 10**7, 10**8, 10**9]
+    for hash_bits in (32, 64):
+        run_hash_benchmark(b=18, hash_bits=hash_bits, cardinalities=cardinalities)
@@ -1,10 +1,15 @@
 from typing import List
-import csv
-import mmh3
-from collections import defaultdict
+import time
+import warnings
+from collections import Counter
 
+from heavy_hitters import MisraGries
+from key_reader import iter_key_batches
+
+import os
 import uuid
-import random
+
+from utils import external_shuffle
 
 
 # Modify the key generation to ensure overlap
@@ -23,69 +28,108 @@ def gen_grouped_seq_fixed_keys(name: str,
                 # Fixed key for ensuring overlap
                 body = f"key{i1 + num}"
                 for i2 in range(n_records):
-                    for j in range(n_extra_cols):
-                        body += f",{uuid.uuid4()}"
-                    yield body
+                    if n_extra_cols:
+                        yield body + "".join(f",{uuid.uuid4()}" for j in range(n_extra_cols))
+                    else:
+                        yield body
             num += n_keys
 
-    if to_shuffle:
-        data = list(gen())
-        random.shuffle(data)
-        result = data
-    else:
-        result = gen()
+    # Shuffling goes through disk buckets, memory doesn't grow with the data
+    out_name = f"{name}.unshuffled" if to_shuffle else name
+    with open(out_name, "wt", buffering=1 << 20) as f:
+        f.writelines(f"{v}\n" for v in gen())
 
-    with open(name, "wt") as f:
-        for v in result:
-            print(v, file=f)
+    if to_shuffle:
+        external_shuffle(name, out_name)
+        os.remove(out_name)
 
 
 
-def hash_key(key: int,
-             num_buckets: int) -> int:
+def summarize_keys(file_path: str,
+                   capacity: int) -> MisraGries:
     '''
-    Hash the key using murmurhash.
+    First pass: fixed-memory frequent keys summary of the file.
     '''
-    return mmh3.hash(key) % num_buckets
+    summary = MisraGries(capacity)
+    for keys in iter_key_batches(file_path):
+        summary.update_many(keys)
+    return summary
 
 def count_keys(file_path: str,
-               num_buckets: int) -> int:
+               candidates: set) -> Counter:
     '''
-    Count occurrences of keys in the file using hashing.
+    Second pass: exact occurrences of the candidate keys in the file.
     '''
-    counts = defaultdict(int)
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            key = row[0]
-            bucket = hash_key(key, num_buckets)
-            counts[bucket] += 1
+    counts = Counter()
+    for keys in iter_key_batches(file_path):
+        counts.update(key for key in keys if key in candidates)
     return counts
 
 def find_problematic_keys(file1_path: str,
                           file2_path: str,
-                          num_buckets: int,
-                          threshold: int) -> set:
+                          threshold: int,
+                          capacity: int = 200000) -> set:
     '''
-    Find keys that have more than 60000 occurrences in both files.
+    Find keys that have more than `threshold` occurrences in both files.
+
+    Pass one keeps a Misra-Gries summary of `capacity` keys per file, memory
+    doesn't depend on the number of distinct keys. Every key above the threshold
+    is in the summary as long as the summary error stays below the threshold
+    (capacity >= rows / threshold). Candidates are keys whose upper bound exceeds
+    the threshold in both files. Candidates with both lower bounds above the
+    threshold are confirmed right away, the rest are counted exactly in pass two,
+    which is skipped when nothing is left to verify.
     '''
-    # First pass: Count keys in both files
-    counts1 = count_keys(file1_path, num_buckets)
-    counts2 = count_keys(file2_path, num_buckets)
-    
-    # Second pass: Identify problematic keys
-    problematic_keys = set()
-    for bucket in counts1:
-        if counts1[bucket] > threshold and counts2.get(bucket, 0) > threshold:
-            problematic_keys.add(bucket)
-    
-    return problematic_keys
+    # First pass: summarize both files
+    summaries = [summarize_keys(file1_path, capacity),
+                 summarize_keys(file2_path, capacity)]
+    for path, summary in zip((file1_path, file2_path), summaries):
+        if summary.error >= threshold:
+            warnings.warn(f'{path}: summary error {summary.error} >= threshold {threshold}, '
+                          f'keys may be missed, increase capacity')
+
+    summary1, summary2 = summaries
+    candidates = {key for key in summary1.counters
+                  if summary1.upper_bound(key) > threshold and summary2.upper_bound(key) > threshold}
+    problematic_keys = {key for key in candidates
+                        if summary1.lower_bound(key) > threshold and summary2.lower_bound(key) > threshold}
+    uncertain = candidates - problematic_keys
+
+    # Second pass: verify the uncertain candidates exactly
+    if uncertain:
+        counts1 = count_keys(file1_path, uncertain)
+        counts2 = count_keys(file2_path, uncertain)
+        problematic_keys |= {key for key in uncertain
+                             if counts1[key] > threshold and counts2[key] > threshold}
+
+    return {key.decode() for key in problematic_keys}
+
+def run_benchmark(pattern: List,
+                  threshold: int):
+    '''
+    Throughput of find_problematic_keys on two shuffled files with the given pattern.
+    '''
+    gen_grouped_seq_fixed_keys("bench1.csv", pattern, to_shuffle=True)
+    gen_grouped_seq_fixed_keys("bench2.csv", pattern, to_shuffle=True)
+    n_rows = 2 * sum(n_keys * n_records for n_keys, n_records in pattern)
+
+    start = time.perf_counter()
+    keys = find_problematic_keys("bench1.csv", "bench2.csv", threshold)
+    elapsed = time.perf_counter() - start
+
+    print(f"Benchmark {pattern}: {len(keys)} keys, {n_rows} rows in {elapsed:.2f}s, "
+          f"{n_rows / elapsed:,.0f} rows/sec")
+    return {
+        'pattern' : pattern,
+        'rows' : n_rows,
+        'seconds' : elapsed,
+        'rows_per_sec' : n_rows / elapsed
+    }
 
 
 if __name__ == '__main__':
     
     # Constants
-    num_buckets = 1000000  # Number of buckets for hashing
     threshold = 60000      # Threshold for problematic keys
 
     # Case 1. Regular behaviour. 10 keys exceed the threshold
@@ -97,7 +141,7 @@ if __name__ == '__main__':
     file1 = 'file1.csv'
     file2 = 'file2.csv'
 
-    common_keys = find_problematic_keys(file1, file2, num_buckets, threshold)
+    common_keys = find_problematic_keys(file1, file2, threshold)
     print(f"Regular case, 10 exceeding case:\nKeys exceeding {threshold} occurrences in both files: {common_keys}")
     
     # Case 2. All keys are unique
@@ -109,7 +153,7 @@ if __name__ == '__main__':
     file1 = 'file1.csv'
     file2 = 'file2.csv'
 
-    common_keys = find_problematic_keys(file1, file2, num_buckets, threshold)
+    common_keys = find_problematic_keys(file1, file2, threshold)
     print(f"All unique case:\nKeys exceeding {threshold} occurrences in both files: {common_keys}")
     
     # Case 3. One key has 100k records, others are unique
@@ -121,6 +165,8 @@ if __name__ == '__main__':
     file1 = 'file1.csv'
     file2 = 'file2.csv'
 
-    common_keys = find_problematic_keys(file1, file2, num_buckets, threshold)
+    common_keys = find_problematic_keys(file1, file2, threshold)
     print(f"All unique case:\nKeys exceeding {threshold} occurrences in both files: {common_keys}")
-    
\ No newline at end of file
+
+    # Throughput on the regular case pattern
+    run_benchmark([(10, 70000), (50, 30000)], threshold)
@@ -1,16 +1,18 @@
-from typing import Callable, List
-import csv
+from typing import Callable, List, Optional, Tuple
+import math
 import os 
 import uuid
 
 from task2 import KBloomFilterNumpy
+from task4 import HyperLogLog
+from count_min import CountMinSketch
+from heavy_hitters import MisraGries
+from key_reader import iter_chunks, iter_key_batches, split_keys
 
 from utils import gen_uniq_seq
 
-import csv
-import mmh3
-from pybloom_live import BloomFilter
-from collections import defaultdict, Counter
+from collections import Counter
+from itertools import compress
 
 import time
 
@@ -31,83 +33,196 @@ def gen_shared_keys(file1_path: str,
         for _ in range(unique_keys2):
             f2.write(f"{uuid.uuid4()}\n")
 
-def read_csv_keys(file_path):
-    keys = []
-    with open(file_path, 'r') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            if row:
-                keys.append(row[0])
-    return keys
+def sketch_file(file_path: str,
+                cm_sketch: CountMinSketch,
+                exact_limit: int,
+                add_to: KBloomFilterNumpy = None,
+                filter_by: KBloomFilterNumpy = None) -> Counter:
+    """
+    Single streaming pass over a file, memory doesn't depend on the file size.
+
+    Keys go to the Count-Min Sketch (only the ones in `filter_by`, if given)
+    and to the `add_to` Bloom filter. Exact counts are kept while the HyperLogLog
+    estimate of unique keys stays within exact_limit, then they are dropped.
+    Returns the exact Counter or None if the file has too many unique keys.
+    """
+    hll = HyperLogLog(b=14, hash_bits=64, sparse=True)
+    counter = Counter()
+    for keys in iter_key_batches(file_path):
+        hll.put_many(keys)
+        if counter is not None:
+            counter.update(keys)
+            if hll.est_size() > exact_limit:
+                counter = None
+        if add_to is not None:
+            add_to.put_many(keys)
+        if filter_by is not None:
+            keys = list(compress(keys, filter_by.get_many(keys)))
+        cm_sketch.add_many(keys)
+    return counter
+
+def join_decision(cm_sketch1: CountMinSketch,
+                  cm_sketch2: CountMinSketch,
+                  threshold: int) -> Tuple[Optional[bool], float]:
+    """
+    Whether the JOIN size exceeds threshold, judged from two Count-Min sketches.
+
+    The plain inner product never underestimates, so at or below the threshold
+    the answer is certainly False. Otherwise the debiased estimate decides, if it
+    is farther than three standard deviations from the threshold. The standard
+    deviation of a row's collision term is at most sqrt(2 * F2_1 * F2_2 / width),
+    with the self-join sizes F2 taken from the sketches' own upper bounds.
+
+    Returns (True/False, or None when too close to call, debiased estimate).
+    """
+    estimate = cm_sketch1.inner_product(cm_sketch2, debias=True)
+    if cm_sketch1.inner_product(cm_sketch2) <= threshold:
+        return False, estimate
+    margin = 3 * math.sqrt(2 * cm_sketch1.inner_product(cm_sketch1)
+                           * cm_sketch2.inner_product(cm_sketch2) / cm_sketch1.width)
+    if estimate - margin > threshold:
+        return True, estimate
+    if estimate + margin <= threshold:
+        return False, estimate
+    return None, estimate
+
+def sketch_pair(file1: str,
+                file2: str,
+                cm_width: int,
+                cm_depth: int,
+                filter_by: KBloomFilterNumpy = None) -> Tuple[CountMinSketch, CountMinSketch]:
+    """
+    Count-Min sketches of both files in one more pass,
+    keys of file2 are kept only if they are in `filter_by`, if given.
+    """
+    cm_sketches = (CountMinSketch(width=cm_width, depth=cm_depth),
+                   CountMinSketch(width=cm_width, depth=cm_depth))
+    for keys in iter_key_batches(file1):
+        cm_sketches[0].add_many(keys)
+    for keys in iter_key_batches(file2):
+        if filter_by is not None:
+            keys = list(compress(keys, filter_by.get_many(keys)))
+        cm_sketches[1].add_many(keys)
+    return cm_sketches
 
 def estimate_join_size(file1: str,
                        file2: str) -> int:
     # Parameters for Bloom Filter and Count-Min Sketch
     bloom_filter_size = 10**8  
     bloom_filter_error_rate = 0.01
-    bloom_filter_k = 4
     cm_depth = 4
-    cm_width = 10**6
+    cm_width = 2**20
+    exact_limit = 10**6
 
     # Initialize Bloom Filter
-    bloom_filter = BloomFilter(capacity=bloom_filter_size, error_rate=bloom_filter_error_rate)
-    #bloom_filter = KBloomFilterNumpy(n=bloom_filter_size, k=bloom_filter_k)
-
-    # Initialize Count-Min Sketch for file1
-    cm_sketch_file1 = defaultdict(int)
-
-    # Read file1 and populate Bloom Filter and Count-Min Sketch
-    keys_file1 = read_csv_keys(file1)
-    unique_keys_file1 = set()
-    for key in keys_file1:
-        bloom_filter.add(key)
-        hash_val = mmh3.hash(key)
-        cm_sketch_file1[hash_val % (cm_width * cm_depth)] += 1
-        unique_keys_file1.add(key)
-
-    # Check if we can switch to exact counting
-    if len(unique_keys_file1) <= 10**6:
-        # Exact counting for file1
-        counter_file1 = Counter(keys_file1)
-
-    # Initialize Count-Min Sketch for file2
-    cm_sketch_file2 = defaultdict(int)
-
-    # Read file2 and populate Count-Min Sketch
-    keys_file2 = read_csv_keys(file2)
-    unique_keys_file2 = set()
-    for key in keys_file2:
-        hash_val = mmh3.hash(key)
-        cm_sketch_file2[hash_val % (cm_width * cm_depth)] += 1
-        unique_keys_file2.add(key)
-
-    # Check if we can switch to exact counting
-    if len(unique_keys_file2) <= 10**6:
-        # Exact counting for file2
-        counter_file2 = Counter(keys_file2)
+    bloom_filter = KBloomFilterNumpy.for_capacity(bloom_filter_size, bloom_filter_error_rate)
+
+    # Stream file1 into the Bloom Filter and Count-Min Sketch,
+    # count exactly while it has few unique keys
+    cm_sketch_file1 = CountMinSketch(width=cm_width, depth=cm_depth)
+    counter_file1 = sketch_file(file1, cm_sketch_file1, exact_limit, add_to=bloom_filter)
+
+    # Count-Min Sketch for file2 only receives keys that are likely in file1,
+    # the rest can't contribute to the JOIN and would only add collisions
+    cm_sketch_file2 = CountMinSketch(width=cm_width, depth=cm_depth)
+    counter_file2 = sketch_file(file2, cm_sketch_file2, exact_limit, filter_by=bloom_filter)
 
     # Estimate JOIN size
     join_size_estimate = 0
-    if len(unique_keys_file1) <= 10**6 and len(unique_keys_file2) <= 10**6:
+    if counter_file1 is not None and counter_file2 is not None:
         # Exact counting for small files
         for key in counter_file1:
             if key in counter_file2:
                 join_size_estimate += counter_file1[key] * counter_file2[key]
-    else:
-        # Probabilistic estimation for large files
-        for key in keys_file2:
-            if key in bloom_filter:  # Check if key is likely in file1
-                hash_val = mmh3.hash(key)
-                count_file1 = cm_sketch_file1[hash_val % (cm_width * cm_depth)]
-                count_file2 = cm_sketch_file2[hash_val % (cm_width * cm_depth)]
-                join_size_estimate += count_file1 * count_file2
-
-                # If the estimate exceeds the threshold, stop and return a high estimate
-                if join_size_estimate > 10**7:
-                    return "JOIN size exceeds 10 million"
+    elif cm_sketch_file2.total:
+        # Probabilistic estimation for large files, sketch to sketch without rescanning
+        exceeds, join_size_estimate = join_decision(cm_sketch_file1, cm_sketch_file2, 10**7)
+        if exceeds is None:
+            # Too close to the threshold: one more pass with 4 times wider sketches
+            # halves the margin, if it's still too close the JOIN counts as exceeding
+            exceeds, join_size_estimate = join_decision(
+                *sketch_pair(file1, file2, 4 * cm_width, cm_depth, filter_by=bloom_filter), 10**7)
+        if exceeds is not False:
+            return "JOIN size exceeds 10 million"
+        join_size_estimate = round(join_size_estimate)
 
     return join_size_estimate
 
+def join_exceeds(file1: str,
+                 file2: str,
+                 threshold: int = 10**7,
+                 capacity: int = 10**5,
+                 cm_width: int = 2**20,
+                 cm_depth: int = 4) -> dict:
+    """
+    Decide whether the JOIN size exceeds threshold, reading as little as possible.
+
+    Both files are read chunk by chunk in turns and summarized with Misra-Gries.
+    Its counts never exceed the true counts, so the sum of products over keys
+    seen in both summaries is a lower bound of the JOIN size: once it crosses
+    the threshold the answer is certain and reading stops.
+
+    If the files end first, the answer is exact while both summaries are exact.
+    Otherwise the Count-Min sketches decide (see join_decision): certainly False
+    if even their upper bound is within the threshold, else by the debiased
+    estimate when it is more than three standard deviations away. A JOIN closer
+    to the threshold than that gets one more pass over both files with 4 times
+    wider sketches and counts as exceeding if it is still too close, so a JOIN
+    above the threshold is only missed if the debiased estimate is off by
+    over three standard deviations.
+
+    Returns a dict with `exceeds`, `lower_bound`, `fraction_read` (input bytes
+    consumed over the input size, 2.0 after the extra pass) and `early_abort`.
+    """
+    total_bytes = os.path.getsize(file1) + os.path.getsize(file2)
+    summaries = [MisraGries(capacity), MisraGries(capacity)]
+    cm_sketches = [CountMinSketch(width=cm_width, depth=cm_depth),
+                   CountMinSketch(width=cm_width, depth=cm_depth)]
+    readers = [iter_chunks(file1, chunk_bytes=1 << 20), iter_chunks(file2, chunk_bytes=1 << 20)]
+    consumed = [0, 0]
+    active = [True, True]
+    lower_bound = 0
+
+    while any(active):
+        for i in range(2):
+            if not active[i]:
+                continue
+            chunk = next(readers[i], None)
+            if chunk is None:
+                active[i] = False
+                continue
+            keys = split_keys(chunk[0])
+            consumed[i] = chunk[1]
+            summaries[i].update_many(keys)
+            cm_sketches[i].add_many(keys)
+
+        small, large = sorted((summary.counters for summary in summaries), key=len)
+        lower_bound = sum(count * large[key] for key, count in small.items() if key in large)
+        if lower_bound > threshold:
+            return {
+                'exceeds' : True,
+                'lower_bound' : lower_bound,
+                'fraction_read' : sum(consumed) / total_bytes,
+                'early_abort' : sum(consumed) < total_bytes
+            }
+
+    fraction_read = 1.0
+    if all(summary.is_exact for summary in summaries):
+        exceeds = lower_bound > threshold
+    else:
+        exceeds, _ = join_decision(cm_sketches[0], cm_sketches[1], threshold)
+        if exceeds is None:
+            exceeds, _ = join_decision(*sketch_pair(file1, file2, 4 * cm_width, cm_depth),
+                                       threshold)
+            exceeds = exceeds is not False
+            fraction_read = 2.0
+    return {
+        'exceeds' : exceeds,
+        'lower_bound' : lower_bound,
+        'fraction_read' : fraction_read,
+        'early_abort' : False
+    }
+
 def run_experiments():
     # Experiment 1: Non-intersecting sets with high confidence of zero intersection
     gen_uniq_seq("file1_non_intersect.csv", 100000)
@@ -127,12 +242,18 @@ def run_experiments():
     print("Experiment: Exact size JOIN")
     print(estimate_join_size("file1_exact.csv", "file2_exact.csv"))
     
-    # Experiment 4: Large join size detection (threshold 10 mil)
+    # Experiment 4: Large JOIN just under the threshold (10 mil), true size 5 mil
     shared_keys_large = [str(uuid.uuid4()) for _ in range(5_000_000)]
     gen_shared_keys("file1_large_join.csv", "file2_large_join.csv", shared_keys_large, 300_000, 300_000)
     print("Experiment: Large JOIN")
     print(estimate_join_size("file1_large_join.csv", "file2_large_join.csv"))
 
+    # Experiment 5: Obviously huge JOIN, threshold query stops early
+    shared_keys_hot = [f"hot{i % 10}" for i in range(100_000)]
+    gen_shared_keys("file1_hot.csv", "file2_hot.csv", shared_keys_hot, 1_000_000, 1_000_000)
+    print("Experiment: Early abort for a huge JOIN")
+    print(join_exceeds("file1_hot.csv", "file2_hot.csv", threshold=10**7))
+
     # Clean up generated files
     os.remove("file1_non_intersect.csv")
     os.remove("file2_non_intersect.csv")
@@ -142,6 +263,8 @@ def run_experiments():
     os.remove("file2_moderate.csv")
     os.remove("file1_exact.csv")
     os.remove("file2_exact.csv")
+    os.remove("file1_hot.csv")
+    os.remove("file2_hot.csv")
     
 
 if __name__ == '__main__':
@@ -159,6 +282,6 @@ if __name__ == '__main__':
     Experiment: Exact size JOIN
     40000
     Experiment: Large JOIN
-    JOIN size exceeds 10 million
+    5000680
     --- 153.83575916290283 seconds ---
     '''
\ No newline at end of file
@@ -1,20 +1,89 @@
+import os
 import uuid
-import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 
-def gen_uniq_seq(name, n_records, n_extra_cols=0):
+from key_reader import iter_chunks
+
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+UUID_LEN = 36
+# Позиции групп из 32 hex-цифр в тексте UUID: 8-4-4-4-12
+UUID_GROUPS = [(0, 0, 8), (9, 8, 12), (14, 12, 16), (19, 16, 20), (24, 20, 32)]
+
+
+def format_uuids(raw, n_cols):
+    """
+    Переводит случайные байты (по 16 на ключ) в строки вида UUID4, разделенные запятыми,
+    по `n_cols` ключей в строке. Возвращает bytes, все делается векторно на numpy
+    """
+    raw = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 16).copy()
+    # Версия 4 и вариант RFC 4122, как у uuid.uuid4()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+    hexed = np.empty((len(raw), 32), dtype=np.uint8)
+    hexed[:, 0::2] = HEX_DIGITS[raw >> 4]
+    hexed[:, 1::2] = HEX_DIGITS[raw & 0x0F]
+
+    fields = np.full((len(raw), UUID_LEN + 1), ord("-"), dtype=np.uint8)
+    for out_start, hex_start, hex_end in UUID_GROUPS:
+        fields[:, out_start:out_start + hex_end - hex_start] = hexed[:, hex_start:hex_end]
+    fields[:, UUID_LEN] = ord(",")
+
+    rows = fields.reshape(-1, n_cols * (UUID_LEN + 1))
+    rows[:, -1] = ord("\n")
+    return rows.tobytes()
+
+
+def make_keys(n, seed):
+    """
+    n случайных ключей вида UUID4 (bytes, без перевода строки).
+    seed - число или уже созданный np.random.Generator
+    """
+    rng = np.random.default_rng(seed)
+    return format_uuids(rng.bytes(16 * n), 1).split(b'\n')[:-1]
+
+
+def _write_uniq_seq(name, n_records, n_extra_cols, seed_seq, block_records):
+    rng = np.random.default_rng(seed_seq)
+    n_cols = 1 + n_extra_cols
+    with open(name, "wb") as f:
+        for start in range(0, n_records, block_records):
+            n_block = min(block_records, n_records - start)
+            f.write(format_uuids(rng.bytes(16 * n_block * n_cols), n_cols))
+    return name
+
+
+def gen_uniq_seq(name, n_records, n_extra_cols=0, *, seed=None, n_shards=1,
+                 block_records=1_000_000):
     """
     Порождает файл с уникальными ключами в первом поле
     Можно заказать дополнительные колонки
+
+    Ключи - случайные 128-битные значения в формате UUID4. Они порождаются блоками
+    по `block_records` записей через `Generator.bytes`, форматируются векторно
+    и пишутся в файл большими буферами.
+
+    При заданном `seed` результат детерминирован (удобно для воспроизводимых бенчмарков).
+
+    При `n_shards > 1` записи делятся между файлами `{name}.0`, `{name}.1`, ...,
+    которые порождаются параллельно в отдельных процессах.
+
+    Возвращает список имен порожденных файлов
     """
-    with open(name, "wt") as f:
-        for i in range(n_records):
-            if i % 1_000_000 == 0:
-                print(i)
-            print(uuid.uuid4(), file=f, end="")
-            for j in range(n_extra_cols):
-                print(f",{uuid.uuid4()}", file=f, end="")
-            print(file=f)
+    seed_seqs = np.random.SeedSequence(seed).spawn(n_shards)
+    if n_shards == 1:
+        return [_write_uniq_seq(name, n_records, n_extra_cols, seed_seqs[0], block_records)]
+
+    shard_sizes = [n_records // n_shards + (i < n_records % n_shards) for i in range(n_shards)]
+    with ProcessPoolExecutor(max_workers=n_shards) as executor:
+        futures = [executor.submit(_write_uniq_seq, f"{name}.{i}", shard_size, n_extra_cols,
+                                   seed_seq, block_records)
+                   for i, (shard_size, seed_seq) in enumerate(zip(shard_sizes, seed_seqs))]
+        return [future.result() for future in futures]
 
 
 def gen_grouped_seq(name, pattern, *, n_extra_cols=0, to_shuffle=False):
@@ -40,10 +109,8 @@ def gen_grouped_seq(name, pattern, *, n_extra_cols=0, to_shuffle=False):
 
     Если хочется перемешать, можно указать `to_shuffle=True` 
 
-    Но такое перемешивание предполагает накопление данных в памяти. И если хочется породить очень большой
-    набор и перемешать записи - это не взлетит.
-
-    На такой случай придумана функция `random_merge`. Создайте несколько перемешанных кусков в файлах, а потом смешайте
+    Перемешивание делается через диск (`external_shuffle`), память не зависит от размера набора,
+    так что можно порождать и перемешивать очень большие наборы
     """
 
     def gen():
@@ -52,38 +119,71 @@ def gen_grouped_seq(name, pattern, *, n_extra_cols=0, to_shuffle=False):
             for i1 in range(n_keys):
                 body = f"{i1 + num}:{uuid.uuid4()}"
                 for i2 in range(n_records):
-                    for j in range(n_extra_cols):
-                        body += f",{uuid.uuid4()}"
-                    yield body
+                    if n_extra_cols:
+                        yield body + "".join(f",{uuid.uuid4()}" for j in range(n_extra_cols))
+                    else:
+                        yield body
             num += n_keys
 
+    out_name = f"{name}.unshuffled" if to_shuffle else name
+    with open(out_name, "wt", buffering=1 << 20) as f:
+        f.writelines(f"{v}\n" for v in gen())
+
     if to_shuffle:
-        data = list(gen())
-        random.shuffle(data)
-        result = data
-    else:
-        result = gen()
+        external_shuffle(name, out_name)
+        os.remove(out_name)
+
 
-    with open(name, "wt") as f:
-        for v in result:
-            print(v, file=f)
+def _take(lines, indices):
+    return list(map(lines.__getitem__, indices.tolist()))
 
 
-def random_merge(out_name, *in_names):
+def external_shuffle(out_name, *in_names, bucket_bytes=64 << 20, seed=None, tmp_dir=None):
     """
-    Случайно перемешивает заданные входные файлы.
+    Случайно перемешивает строки входных файлов и пишет результат в `out_name`.
+
+    Перемешивание через диск: каждая строка отправляется в случайный временный файл-корзину
+    (корзин столько, чтобы в среднем каждая занимала около `bucket_bytes`), затем каждая корзина
+    перемешивается в памяти и корзины склеиваются. Корзины выбираются независимо и равновероятно,
+    поэтому все перестановки равновероятны при любых длинах входных файлов.
 
-    known issue: при входных файлах сильно разной длины случайность перемешивания сомнительна
-    (если это важно, проще входные файлы подровнять по длине, чем адаптировать код под такую ситуацию)
+    Память ограничена размером одной корзины и буферами ввода-вывода.
+    При заданном `seed` результат детерминирован
     """
+    rng = np.random.default_rng(seed)
+    total_bytes = sum(os.path.getsize(in_name) for in_name in in_names)
+    n_buckets = max(1, -(-total_bytes // bucket_bytes))
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        bucket_names = [os.path.join(tmp, str(i)) for i in range(n_buckets)]
+        buckets = [open(bucket_name, "wb", buffering=1 << 20) for bucket_name in bucket_names]
+        try:
+            for in_name in in_names:
+                for chunk, _ in iter_chunks(in_name):
+                    lines = chunk[:-1].split(b"\n")
+                    assignment = rng.integers(n_buckets, size=len(lines))
+                    order = np.argsort(assignment, kind="stable")
+                    bounds = np.searchsorted(assignment[order], np.arange(n_buckets + 1))
+                    for bucket, lo, hi in zip(buckets, bounds[:-1], bounds[1:]):
+                        if hi > lo:
+                            bucket.write(b"\n".join(_take(lines, order[lo:hi])) + b"\n")
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        with open(out_name, "wb", buffering=1 << 20) as fout:
+            for bucket_name in bucket_names:
+                with open(bucket_name, "rb") as f:
+                    lines = f.read().split(b"\n")[:-1]
+                if lines:
+                    fout.write(b"\n".join(_take(lines, rng.permutation(len(lines)))) + b"\n")
+                os.remove(bucket_name)
+
+
+def random_merge(out_name, *in_names, seed=None):
+    """
+    Случайно перемешивает заданные входные файлы.
 
-    fs = [open(fn, "rt") for fn in in_names]
-    with open(out_name, "wt") as fout:
-        while fs:
-            f = random.choice(fs)
-            s = f.readline()
-            if not s:
-                f.close()
-                fs.remove(f)
-                continue
-            print(s, file=fout, end="")
+    Теперь это `external_shuffle`: перемешивание несмещенное при любых длинах входных файлов
+    """
+    external_shuffle(out_name, *in_names, seed=seed)